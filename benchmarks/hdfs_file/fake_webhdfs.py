@@ -0,0 +1,481 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+In-process WebHDFS stand-in, used to exercise library/hdfs_file.py without a real cluster.
+
+The namespace is held in memory. Each server simulates one NameNode (and its DataNode redirects). Several servers
+can share the same Namespace and a Cluster object to simulate Namenode H.A., with one active and others standby.
+
+Usage, as a standalone server:
+
+    python benchmarks/hdfs_file/fake_webhdfs.py --port 50070 --latency 0.002
+"""
+
+import argparse
+import binascii
+import hashlib
+import json
+import posixpath
+import socket
+import struct
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+
+STORAGE_POLICIES = {'PROVIDED': 1, 'COLD': 2, 'WARM': 5, 'HOT': 7, 'ONE_SSD': 10, 'ALL_SSD': 12, 'LAZY_PERSIST': 15}
+
+BYTES_PER_CRC = 512
+
+_CRC32C_TABLE = []
+for _i in range(256):
+    _c = _i
+    for _j in range(8):
+        _c = (_c >> 1) ^ 0x82F63B78 if _c & 1 else _c >> 1
+    _CRC32C_TABLE.append(_c)
+
+
+def crc32c(data):
+    crc = 0xFFFFFFFF
+    table = _CRC32C_TABLE
+    for b in bytearray(data):
+        crc = table[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def fileChecksum(data, blockSize):
+    """MD5-of-MD5-of-CRC32C, as computed by HDFS for a file written with default settings"""
+    if not data:
+        # No block: HDFS returns a constant, built from 32 zero bytes, whatever the settings
+        return {
+            'algorithm': 'MD5-of-0MD5-of-0CRC32',
+            'bytes': binascii.hexlify(struct.pack('>iq', 0, 0) + hashlib.md5(b'\0' * 32).digest()).decode('ascii'),
+            'length': 28
+        }
+    blockMd5s = b''
+    for blockStart in range(0, len(data), blockSize):
+        block = data[blockStart:blockStart + blockSize]
+        crcs = b''.join(struct.pack('>I', crc32c(block[i:i + BYTES_PER_CRC])) for i in range(0, len(block), BYTES_PER_CRC))
+        blockMd5s += hashlib.md5(crcs).digest()
+    crcPerBlock = blockSize // BYTES_PER_CRC if len(data) > blockSize else 0
+    return {
+        'algorithm': 'MD5-of-{0}MD5-of-{1}CRC32C'.format(crcPerBlock, BYTES_PER_CRC),
+        'bytes': binascii.hexlify(struct.pack('>iq', BYTES_PER_CRC, crcPerBlock) + hashlib.md5(blockMd5s).digest()).decode('ascii'),
+        'length': 28
+    }
+
+
+class RemoteError(Exception):
+    def __init__(self, code, exception, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.exception = exception
+
+
+def notFound(path):
+    return RemoteError(404, 'FileNotFoundException', 'File does not exist: ' + path)
+
+
+class Namespace(object):
+    """In memory HDFS namespace. All operations are serialized by a single lock, like the namesystem lock"""
+
+    def __init__(self, blockSize=134217728):
+        self.lock = threading.RLock()
+        self.blockSize = blockSize
+        self.nodes = {}
+        self.children = {}
+        self._add('/', 'DIRECTORY', 'hdfs', 'supergroup', '755')
+
+    def _add(self, path, type, owner, group, permission, data=b''):
+        now = int(time.time() * 1000)
+        self.nodes[path] = {
+            'type': type, 'owner': owner, 'group': group, 'permission': permission,
+            'modificationTime': now, 'accessTime': now, 'length': len(data),
+            'replication': 3 if type == 'FILE' else 0, 'blockSize': self.blockSize if type == 'FILE' else 0,
+            'storagePolicy': 0, 'data': data, 'quota': -1, 'spaceQuota': -1
+        }
+        if type == 'DIRECTORY':
+            self.children[path] = set()
+        if path != '/':
+            self.children[posixpath.dirname(path)].add(posixpath.basename(path))
+
+    def _get(self, path):
+        if path not in self.nodes:
+            raise notFound(path)
+        return self.nodes[path]
+
+    def status(self, path, suffix=''):
+        node = self._get(path)
+        fs = dict((k, v) for (k, v) in node.items() if k not in ('data', 'quota', 'spaceQuota'))
+        fs['pathSuffix'] = suffix
+        fs['childrenNum'] = len(self.children.get(path, ()))
+        fs['fileId'] = id(node)
+        return fs
+
+    def list(self, path, startAfter=None, limit=None):
+        node = self._get(path)
+        if node['type'] != 'DIRECTORY':
+            return [self.status(path)], 0
+        names = sorted(self.children[path])
+        if startAfter is not None:
+            names = [n for n in names if n > startAfter]
+        remaining = 0
+        if limit is not None and len(names) > limit:
+            remaining = len(names) - limit
+            names = names[:limit]
+        return [self.status(posixpath.join(path, n), n) for n in names], remaining
+
+    def mkdirs(self, path, user, permission):
+        current = '/'
+        for part in [x for x in path.split('/') if x]:
+            current = posixpath.join(current, part)
+            if current not in self.nodes:
+                self._add(current, 'DIRECTORY', user, 'supergroup', permission or '755')
+            elif self.nodes[current]['type'] != 'DIRECTORY':
+                raise RemoteError(403, 'ParentNotDirectoryException', current + ' is not a directory')
+
+    def create(self, path, user, permission, overwrite, data):
+        if path in self.nodes:
+            if not overwrite or self.nodes[path]['type'] == 'DIRECTORY':
+                raise RemoteError(403, 'FileAlreadyExistsException', path + ' already exists')
+            self.delete(path, False)
+        self.mkdirs(posixpath.dirname(path), user, None)
+        self._add(path, 'FILE', user, 'supergroup', permission or '644', data)
+
+    def delete(self, path, recursive):
+        if path not in self.nodes:
+            return False
+        if self.children.get(path) and not recursive:
+            raise RemoteError(403, 'PathIsNotEmptyDirectoryException', path + ' is non empty')
+        for name in list(self.children.get(path, ())):
+            self.delete(posixpath.join(path, name), True)
+        self.children.pop(path, None)
+        del self.nodes[path]
+        if path != '/':
+            self.children[posixpath.dirname(path)].discard(posixpath.basename(path))
+        return True
+
+    def rename(self, path, destination):
+        # As HDFS FileSystem.rename(): Into an existing directory, and never over an existing entry
+        if destination in self.nodes and self.nodes[destination]['type'] == 'DIRECTORY':
+            destination = posixpath.join(destination, posixpath.basename(path.rstrip('/')))
+        if path not in self.nodes or destination in self.nodes or posixpath.dirname(destination) not in self.nodes:
+            return False
+        if destination == path or destination.startswith(path.rstrip('/') + '/'):
+            return False
+        moved = [p for p in self.nodes if p == path or p.startswith(path.rstrip('/') + '/')]
+        for p in sorted(moved):
+            newPath = destination + p[len(path):]
+            self.nodes[newPath] = self.nodes.pop(p)
+            if p in self.children:
+                self.children[newPath] = self.children.pop(p)
+        self.children[posixpath.dirname(path)].discard(posixpath.basename(path))
+        self.children[posixpath.dirname(destination)].add(posixpath.basename(destination))
+        return True
+
+    def summary(self, path):
+        node = self._get(path)
+        length = fileCount = directoryCount = spaceConsumed = 0
+        stack = [path]
+        while stack:
+            p = stack.pop()
+            n = self.nodes[p]
+            if n['type'] == 'DIRECTORY':
+                directoryCount += 1
+                stack.extend(posixpath.join(p, c) for c in self.children[p])
+            else:
+                fileCount += 1
+                length += n['length']
+                spaceConsumed += n['length'] * n['replication']
+        return {
+            'length': length, 'fileCount': fileCount, 'directoryCount': directoryCount,
+            'quota': node['quota'], 'spaceConsumed': spaceConsumed, 'spaceQuota': node['spaceQuota'],
+            'typeQuota': {}
+        }
+
+
+class Cluster(object):
+    """Shared H.A. state between several FakeWebHDFS servers"""
+
+    def __init__(self):
+        self.active = None
+        # Delegation tokens are shared by H.A. NameNodes
+        self.tokens = set()
+
+    def failover(self, server):
+        self.active = server
+
+
+class FakeWebHDFS(ThreadingMixIn, HTTPServer):
+    """A fake NameNode WebHDFS endpoint.
+
+    latency: Seconds to wait before answering each request.
+    cluster: If provided, this server answers only when it is cluster.active. Otherwise it returns StandbyException.
+    hang: If True, requests are never answered (Until server shutdown). Simulates a hung NameNode.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, namespace=None, port=0, latency=0.0, cluster=None, host='127.0.0.1'):
+        HTTPServer.__init__(self, (host, port), Handler)
+        self.namespace = namespace if namespace is not None else Namespace()
+        self.latency = latency
+        self.cluster = cluster
+        self.hang = False
+        self.tokens = cluster.tokens if cluster is not None else set()
+        self.statsLock = threading.Lock()
+        self.stats = {}
+        self.thread = None
+
+    @property
+    def endpoint(self):
+        return '{0}:{1}'.format(self.server_address[0], self.server_address[1])
+
+    def isActive(self):
+        return self.cluster is None or self.cluster.active is self
+
+    def count(self, op):
+        with self.statsLock:
+            self.stats[op] = self.stats.get(op, 0) + 1
+
+    def requestCount(self):
+        with self.statsLock:
+            return sum(self.stats.values())
+
+    def resetStats(self):
+        with self.statsLock:
+            self.stats = {}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.hang = False
+        self.shutdown()
+        self.server_close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # Headers and body are written separately. Don't let Nagle's algorithm delay the body
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def reply(self, code, body=None, headers=None):
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def remoteError(self, e):
+        self.reply(e.code, {'RemoteException': {'exception': e.exception, 'javaClassName': 'org.apache.hadoop.' + e.exception, 'message': str(e)}})
+
+    def readBody(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            data = b''
+            while True:
+                size = int(self.rfile.readline().strip().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return data
+                data += self.rfile.read(size)
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def dispatch(self, method):
+        server = self.server
+        url = urlparse(self.path)
+        query = dict((k, v[0]) for (k, v) in parse_qs(url.query).items())
+        body = self.readBody() if method in ('PUT', 'POST') else b''
+        if server.hang:
+            while server.hang:
+                time.sleep(0.05)
+            self.close_connection = True
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        if not url.path.startswith('/webhdfs/v1'):
+            return self.reply(404, {})
+        path = url.path[len('/webhdfs/v1'):] or '/'
+        if len(path) > 1:
+            path = path.rstrip('/')
+        op = query.get('op', '').upper()
+        server.count(op)
+        if not server.isActive():
+            return self.remoteError(RemoteError(403, 'ipc.StandbyException', 'Operation category READ is not supported in state standby'))
+        delegation = query.get('delegation')
+        if delegation is not None and delegation not in server.tokens:
+            return self.remoteError(RemoteError(403, 'security.token.SecretManager$InvalidToken', 'token is expired or doesn\'t exist'))
+        user = query.get('user.name', 'dr.who')
+        ns = server.namespace
+        try:
+            with ns.lock:
+                self.execute(method, op, path, query, body, user, ns)
+        except RemoteError as e:
+            self.remoteError(e)
+
+    def execute(self, method, op, path, query, body, user, ns):
+        if method == 'GET' and op == 'GETFILESTATUS':
+            return self.reply(200, {'FileStatus': ns.status(path)})
+        if method == 'GET' and op == 'LISTSTATUS':
+            statuses = ns.list(path)[0]
+            return self.reply(200, {'FileStatuses': {'FileStatus': statuses}})
+        if method == 'GET' and op == 'LISTSTATUS_BATCH':
+            (statuses, remaining) = ns.list(path, query.get('startafter'), 1000)
+            return self.reply(200, {'DirectoryListing': {'partialListing': {'FileStatuses': {'FileStatus': statuses}}, 'remainingEntries': remaining}})
+        if method == 'GET' and op == 'GETCONTENTSUMMARY':
+            return self.reply(200, {'ContentSummary': ns.summary(path)})
+        if method == 'GET' and op == 'GETQUOTAUSAGE':
+            s = ns.summary(path)
+            return self.reply(200, {'QuotaUsage': {'fileAndDirectoryCount': s['fileCount'] + s['directoryCount'], 'quota': s['quota'],
+                                                   'spaceConsumed': s['spaceConsumed'], 'spaceQuota': s['spaceQuota'], 'typeQuota': {}}})
+        if method == 'GET' and op == 'GETFILECHECKSUM':
+            node = ns._get(path)
+            return self.reply(200, {'FileChecksum': fileChecksum(node['data'], node['blockSize'])})
+        if method == 'GET' and op == 'OPEN':
+            data = ns._get(path)['data']
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if method == 'GET' and op == 'GETALLSTORAGEPOLICY':
+            policies = [{'id': i, 'name': n} for (n, i) in STORAGE_POLICIES.items()]
+            return self.reply(200, {'BlockStoragePolicies': {'BlockStoragePolicy': policies}})
+        if method == 'GET' and op == 'GETDELEGATIONTOKEN':
+            token = 'token-{0}-{1}'.format(user, len(self.server.tokens))
+            self.server.tokens.add(token)
+            return self.reply(200, {'Token': {'urlString': token}})
+        if method == 'PUT' and op == 'RENEWDELEGATIONTOKEN':
+            return self.reply(200, {'long': int(time.time() * 1000) + 86400000})
+        if method == 'PUT' and op == 'MKDIRS':
+            ns.mkdirs(path, user, query.get('permission'))
+            return self.reply(200, {'boolean': True})
+        if method == 'PUT' and op == 'CREATE':
+            if query.get('datanode') != 'true':
+                location = 'http://{0}/webhdfs/v1{1}?{2}&datanode=true'.format(self.server.endpoint, path, urlparse(self.path).query)
+                return self.reply(307, None, {'Location': location})
+            ns.create(path, user, query.get('permission'), query.get('overwrite', 'false') == 'true', body)
+            if 'replication' in query:
+                ns.nodes[path]['replication'] = int(query['replication'])
+            return self.reply(201, None, {'Location': 'hdfs://fake' + path})
+        if method == 'PUT' and op == 'SETOWNER':
+            node = ns._get(path)
+            if 'owner' in query:
+                node['owner'] = query['owner']
+            if 'group' in query:
+                node['group'] = query['group']
+            return self.reply(200)
+        if method == 'PUT' and op == 'SETPERMISSION':
+            ns._get(path)['permission'] = query.get('permission', '755')
+            return self.reply(200)
+        if method == 'PUT' and op == 'SETTIMES':
+            node = ns._get(path)
+            for key in ('modificationTime', 'accessTime'):
+                value = int(query.get(key.lower(), -1))
+                if value != -1:
+                    node[key] = value
+            return self.reply(200)
+        if method == 'PUT' and op == 'SETREPLICATION':
+            node = ns._get(path)
+            if node['type'] != 'FILE':
+                return self.reply(200, {'boolean': False})
+            node['replication'] = int(query.get('replication', 3))
+            return self.reply(200, {'boolean': True})
+        if method == 'PUT' and op == 'SETSTORAGEPOLICY':
+            name = query.get('storagepolicy')
+            if name not in STORAGE_POLICIES:
+                raise RemoteError(400, 'HadoopIllegalArgumentException', 'Cannot find a block policy with the name ' + str(name))
+            ns._get(path)['storagePolicy'] = STORAGE_POLICIES[name]
+            return self.reply(200)
+        if method == 'PUT' and op == 'RENAME':
+            return self.reply(200, {'boolean': ns.rename(path, query.get('destination'))})
+        if method == 'DELETE' and op == 'DELETE':
+            return self.reply(200, {'boolean': ns.delete(path, query.get('recursive', 'false') == 'true')})
+        raise RemoteError(400, 'IllegalArgumentException', 'Invalid value for webhdfs parameter "op": ' + op)
+
+
+def startCluster(namespace, count=2, latency=0.0, ports=None):
+    """Start count servers sharing namespace, the first one being active"""
+    cluster = Cluster()
+    servers = [FakeWebHDFS(namespace, port=(ports[i] if ports else 0), latency=latency, cluster=cluster).start() for i in range(count)]
+    cluster.failover(servers[0])
+    return (cluster, servers)
+
+
+def flipper(cluster, servers, interval):
+    """Start a thread switching the active server every interval seconds. Return a function stopping it"""
+    event = threading.Event()
+
+    def run():
+        while not event.wait(interval):
+            cluster.failover(servers[(servers.index(cluster.active) + 1) % len(servers)])
+    t = threading.Thread(target=run)
+    t.daemon = True
+    t.start()
+
+    def stop():
+        event.set()
+        t.join()
+    return stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake WebHDFS server')
+    parser.add_argument('--port', type=int, default=50070)
+    parser.add_argument('--standby-port', type=int, help='If set, also start a standby NameNode on this port')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering each request')
+    parser.add_argument('--failover-interval', type=float, default=0.0, help='Switch active NameNode every N seconds')
+    parser.add_argument('--block-size', type=int, default=134217728)
+    args = parser.parse_args()
+    ports = [args.port] + ([args.standby_port] if args.standby_port else [])
+    (cluster, servers) = startCluster(Namespace(args.block_size), len(ports), args.latency, ports)
+    if args.failover_interval and len(servers) > 1:
+        flipper(cluster, servers, args.failover_interval)
+    print('Serving fake WebHDFS on ' + ','.join(server.endpoint for server in servers))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
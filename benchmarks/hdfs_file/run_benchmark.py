@@ -0,0 +1,222 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of library/hdfs_file.py, against the fake WebHDFS server of this folder.
+
+Each case is run in a fresh child process, which holds both the fake NameNodes (H.A. pair) and the module, whose
+main() is called in-process. Reported figures are:
+
+    wall_s:     Duration of main()
+    requests:   Number of requests received by the fake NameNodes (Including standby answers and DataNode uploads)
+    peak_rss_mb:Peak resident memory of the child process (Fake namespace included)
+
+Scenarios in 'paths' mode, with one directory entry per path, spread in folders of 1000 entries:
+
+    create:     Empty namespace. All directories are created, and owner/group/mode set.
+    noop:       All directories already in place. Nothing to change.
+    reconcile:  As noop, but with 'reconcile: yes'.
+
+Scenario in 'src' mode, with one file per path (One in ten empty), spread in folders of 1000 entries, each with an
+empty _SUCCESS marker:
+
+    resync:     The local tree is mirrored, then mirrored again, which is measured. Fails if the second run changes
+                anything, or sends any write request.
+
+Usage:
+
+    python benchmarks/hdfs_file/run_benchmark.py --sizes 1000,10000 --latency 0.001
+    python benchmarks/hdfs_file/run_benchmark.py --sizes 100000 --scenarios noop,reconcile --json
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULE_PATH = os.path.join(HERE, '..', '..', 'library', 'hdfs_file.py')
+
+SCENARIOS = ['create', 'noop', 'reconcile', 'resync']
+FOLDER_SIZE = 1000
+OWNER = 'bench'
+GROUP = 'bench'
+MODE = '750'
+# Operations modifying the namespace
+WRITE_OPS = ['MKDIRS', 'CREATE', 'SETOWNER', 'SETPERMISSION', 'SETTIMES', 'SETREPLICATION', 'SETSTORAGEPOLICY', 'RENAME',
+             'DELETE']
+
+
+def loadModule():
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location('hdfs_file', MODULE_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    except ImportError:
+        import imp
+        return imp.load_source('hdfs_file', MODULE_PATH)
+
+
+def manifest(size):
+    return ['/bench/d{0:05d}/p{1:07d}'.format(i // FOLDER_SIZE, i) for i in range(size)]
+
+
+def localTree(size):
+    """Local tree of 'size' files, one in ten empty, to mirror"""
+    root = tempfile.mkdtemp(prefix='hdfs_file_bench_src')
+    for i in range(size):
+        folder = os.path.join(root, 'd{0:05d}'.format(i // FOLDER_SIZE))
+        if not os.path.isdir(folder):
+            os.mkdir(folder)
+            open(os.path.join(folder, '_SUCCESS'), 'wb').close()
+        with open(os.path.join(folder, 'f{0:07d}'.format(i)), 'wb') as f:
+            f.write(b'' if i % 10 == 0 else 'content of file {0}\n'.format(i).encode('ascii') * (i % 50))
+    return root
+
+
+def peakRssMb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on MacOS
+    return round(rss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0), 1)
+
+
+def runMain(hdfsFile, args):
+    """Call hdfs_file.main() in-process and return its result, as printed by exit_json()/fail_json()"""
+    from ansible.module_utils import basic
+    buffer = json.dumps({'ANSIBLE_MODULE_ARGS': args}).encode('utf-8')
+    basic._ANSIBLE_ARGS = buffer
+    if hasattr(basic, '_ANSIBLE_PROFILE'):
+        basic._ANSIBLE_PROFILE = 'legacy'
+    (fd, outPath) = tempfile.mkstemp()
+    savedStdout = os.dup(1)
+    sys.stdout.flush()
+    os.dup2(fd, 1)
+    try:
+        try:
+            hdfsFile.main()
+        except SystemExit:
+            pass
+    finally:
+        sys.stdout.flush()
+        os.dup2(savedStdout, 1)
+        os.close(savedStdout)
+        os.close(fd)
+    with open(outPath) as f:
+        output = f.read()
+    os.remove(outPath)
+    return json.loads(output[output.index('{'):])
+
+
+def runCase(size, scenario, latency, workers, failoverInterval):
+    """Executed in the child process"""
+    sys.path.insert(0, HERE)
+    from fake_webhdfs import Namespace, startCluster, flipper
+    hdfsFile = loadModule()
+
+    namespace = Namespace()
+    paths = manifest(size)
+    if scenario in ('noop', 'reconcile'):
+        for path in paths:
+            namespace.mkdirs(path, OWNER, MODE)
+            namespace.nodes[path]['group'] = GROUP
+    (cluster, servers) = startCluster(namespace, 2, latency)
+    stopFlipper = flipper(cluster, servers, failoverInterval) if failoverInterval else None
+    cacheDir = tempfile.mkdtemp(prefix='hdfs_file_bench')
+    srcDir = None
+    args = {
+        'webhdfs_endpoint': ','.join(server.endpoint for server in servers),
+        'cache_dir': cacheDir,
+        'workers': workers,
+        'state': 'directory',
+        'owner': OWNER,
+        'group': GROUP,
+        'mode': MODE,
+    }
+    if scenario == 'resync':
+        srcDir = localTree(size)
+        args.update({'hdfs_path': '/bench', 'src': srcDir, 'directory_mode': MODE})
+    else:
+        args.update({'paths': [{'hdfs_path': path} for path in paths], 'reconcile': scenario == 'reconcile'})
+    try:
+        result = {}
+        if scenario == 'resync':
+            # Initial upload, not measured
+            result = runMain(hdfsFile, args)
+            for server in servers:
+                server.resetStats()
+        start = time.time()
+        if not result.get('failed'):
+            result = runMain(hdfsFile, args)
+        wall = time.time() - start
+        writes = sum(server.stats.get(op, 0) for server in servers for op in WRITE_OPS)
+        if scenario == 'resync' and not result.get('failed') and (result.get('changed') or writes):
+            result['failed'] = True
+            result['msg'] = 'Second mirroring of an unchanged tree reported changes, with {0} write request(s)'.format(writes)
+    finally:
+        if stopFlipper:
+            stopFlipper()
+        shutil.rmtree(cacheDir, ignore_errors=True)
+        if srcDir:
+            shutil.rmtree(srcDir, ignore_errors=True)
+    return {
+        'size': size,
+        'scenario': scenario,
+        'wall_s': round(wall, 3),
+        'requests': sum(sum(server.stats.values()) for server in servers),
+        'writes': writes,
+        'peak_rss_mb': peakRssMb(),
+        'failed': bool(result.get('failed')),
+        'changed': sum(1 for x in result.get('results', [{'changed': result.get('changed')}]) if x.get('changed')),
+        'msg': result.get('msg'),
+        'http_calls': result.get('http_calls', {})
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark hdfs_file module against a fake WebHDFS server')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Comma separated number of paths')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated, among ' + ', '.join(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to each fake NameNode answer')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--failover-interval', type=float, default=0.0, help='Switch active NameNode every N seconds')
+    parser.add_argument('--json', action='store_true', help='Print one JSON object per case instead of a table')
+    parser.add_argument('--child', nargs=2, metavar=('SIZE', 'SCENARIO'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = runCase(int(args.child[0]), args.child[1], args.latency, args.workers, args.failover_interval)
+        print(json.dumps(result))
+        return
+
+    scenarios = args.scenarios.split(',')
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error('Unknown scenario: ' + scenario)
+    if not args.json:
+        print('{0:>8} {1:<10} {2:>9} {3:>9} {4:>8} {5:>8}  {6}'.format('paths', 'scenario', 'wall_s', 'requests', 'rss_mb', 'changed', 'status'))
+    failed = False
+    for size in [int(x) for x in args.sizes.split(',')]:
+        for scenario in scenarios:
+            cmd = [sys.executable, os.path.abspath(__file__), '--child', str(size), scenario, '--latency', str(args.latency),
+                   '--workers', str(args.workers), '--failover-interval', str(args.failover_interval)]
+            output = subprocess.check_output(cmd).decode('utf-8')
+            result = json.loads(output.strip().splitlines()[-1])
+            failed = failed or result['failed']
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print('{size:>8} {scenario:<10} {wall_s:>9} {requests:>9} {peak_rss_mb:>8} {changed:>8}  {0}'.format(
+                    'FAILED: ' + str(result['msg']) if result['failed'] else 'ok', **result))
+            sys.stdout.flush()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
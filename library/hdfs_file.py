@@ -17,7 +17,24 @@
 # along with this software. If not, see <http://www.gnu.org/licenses/>.
 
 
-from xml.dom import minidom
+import binascii
+import copy
+import hashlib
+import json
+import os
+import posixpath
+import random
+import re
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
 
 
 DOCUMENTATION = '''
@@ -41,19 +58,122 @@ options:
   hdfs_path:
     description:
       - 'HDFS path to the file being managed.  Aliases: I(dest), I(name)'
-    required: true
+      - Exactly one of C(hdfs_path) or C(paths) must be provided.
+    required: false
+    default: None
+  paths:
+    description:
+      - List of HDFS paths to manage in a single invocation. Each entry is either a path string or a
+        dictionary with C(hdfs_path) and any of C(state), C(owner), C(group), C(mode), C(replication),
+        C(storage_policy), C(default_owner), C(default_group) and C(default_mode).
+      - Values not provided in an entry are taken from the module level options.
+      - All entries are handled through a single WebHDFS endpoint lookup and a single keep-alive HTTP session.
+        A failure on one entry does not prevent the others from being processed. Per path results are
+        returned in C(results).
+    required: false
+    default: None
+  reconcile:
+    description:
+      - Only used with C(paths). Instead of fetching the status of each path, group the paths by parent directory and
+        list each parent once (Using C(LISTSTATUS_BATCH) paging when supported by the NameNode). The whole manifest is
+        compared in memory with these listings, and only the needed mutating calls are sent.
+      - Completion is checked by listing again only the parents where something has been changed.
+      - Recommended for large manifests, where most paths share a few parents.
+    required: false
+    default: false
+  usage:
+    description:
+      - If set, nothing is modified. Instead, space usage and quotas of C(hdfs_path), or of all C(paths), are returned
+        as the C(hdfs_usage) fact, a dictionary keyed by path.
+      - If C(content_summary), C(GETCONTENTSUMMARY) is used. It provides C(length), C(files) and C(directories), but the
+        NameNode has to walk the whole tree.
+      - If C(quota_usage), C(GETQUOTAUSAGE) is used. Much cheaper on directories with a quota, but only the total entry
+        count is provided. Falls back to C(GETCONTENTSUMMARY) on NameNodes not supporting it.
+      - Paths are queried using up to C(workers) concurrent calls. A missing path has a null value.
+    required: false
     default: None
+    choices: [ content_summary, quota_usage ]
+  usage_cache_ttl:
+    description:
+      - Number of seconds the values gathered by C(usage) are kept in C(cache_dir) and reused without querying the
+        NameNode. 0 disables the cache.
+    required: false
+    default: 0
   state:
     description:
       - If C(directory), all immediate sub-directories will be created if they
         do not exists, by calling HDFS FileSystem.mkdirs
-        If C(file), the file will NOT be created if it does not exist.
+        If C(file), the file will NOT be created if it does not exist, unless C(src) is provided.
         In both cases, owner, group and mode will be adjusted to provided value.
         If C(absent), directories will be recursively deleted (USE WITH CARE), 
         and file will be deleted.
     required: false
     default: None
     choices: [ file, directory, absent ]
+  src:
+    description:
+      - Path of a local file (On the target host) to upload to C(hdfs_path). Implies C(state=file).
+      - If C(src) is a local directory, its whole tree is mirrored into C(hdfs_path) (Which implies
+        C(state=directory)). The HDFS tree is listed once, then missing directories are created and new or modified
+        files are uploaded, using up to C(workers) concurrent transfers. In this case, C(mode) apply to files, and
+        C(directory_mode) to directories.
+      - The file is streamed in C(chunk_size) chunks, through the WebHDFS CREATE redirection to a DataNode. It is never
+        loaded in memory.
+      - Nothing is uploaded if the HDFS file is identical, as defined by C(compare).
+      - On upload, the HDFS modification time is set to the local one.
+    required: false
+    default: None
+  compare:
+    description:
+      - How to decide if the HDFS file is identical to C(src).
+        If C(checksum), lengths are compared and, if equal, the checksum provided by C(GETFILECHECKSUM) is compared to
+        the one computed locally. If the HDFS checksum algorithm is not supported (Such as COMPOSITE-CRC), fall back to
+        C(size_mtime).
+        If C(size_mtime), length and modification time (At second precision) are compared. Much cheaper, but a file
+        modified in HDFS by other means may be not detected.
+      - Computing C(CRC32C) based checksum is slow in pure python. Install the C(crc32c) python package on target
+        hosts handling big files.
+    required: false
+    default: checksum
+    choices: [ checksum, size_mtime ]
+  directory_mode:
+    description:
+      - When C(src) is a directory, mode of the directories of the mirrored tree.
+    required: false
+    default: None
+  delete:
+    description:
+      - When C(src) is a directory, delete files and directories which are in HDFS but not in C(src).
+    required: false
+    default: false
+  delete_batch_size:
+    description:
+      - If set, a directory to remove (C(state=absent), or C(delete) with C(src)) is deleted bottom-up, in batches of no
+        more than this number of entries, instead of a single recursive DELETE. Each DELETE call then removes a file or a
+        sub-tree of at most this size, and batch calls are spread over C(workers) concurrent connections.
+      - A single recursive DELETE of a huge tree holds the NameNode namesystem lock for a long time, stalling the
+        requests of all other clients. Use this for trees of millions of files.
+      - Progress is reported in the target host log, and the number of deleted entries in C(deleted_entries).
+    required: false
+    default: None
+  delete_pause:
+    description:
+      - When C(delete_batch_size) is set, number of seconds to wait between two batches, to leave room to other
+        NameNode clients.
+    required: false
+    default: 0
+  trash:
+    description:
+      - If C(yes), paths to remove are moved to the trash of C(hdfs_user) (C(/user/<hdfs_user>/.Trash/Current)),
+        as C(hdfs dfs -rm) would do, instead of being deleted. This is a single RENAME call, whatever the tree size.
+        Actual deletion is left to the NameNode trash policy. C(delete_batch_size) does not apply.
+    required: false
+    default: false
+  chunk_size:
+    description:
+      - Size, in bytes, of the chunks used to stream C(src) to HDFS.
+    required: false
+    default: 1048576
   owner:
     description:
       - Name of the user that will own the file/directory, as would
@@ -72,6 +192,35 @@ options:
         fed by HDFS 'FileSystem.setPermission' 
     required: false
     default: None
+  replication:
+    description:
+      - Replication factor of the file, as would be fed by HDFS 'FileSystem.setReplication'. Directories have no
+        replication factor, use C(recurse) to apply it to all files below a directory.
+      - Also used when uploading C(src).
+    required: false
+    default: None
+  storage_policy:
+    description:
+      - Storage policy of the file or directory, such as C(HOT), C(COLD), C(WARM), C(ALL_SSD), C(ONE_SSD) or
+        C(LAZY_PERSIST), as would be fed by HDFS 'FileSystem.setStoragePolicy'.
+      - Entries below a directory inherit its policy. So, with C(recurse), only entries with another explicit policy are
+        modified.
+      - Only new blocks are placed accordingly. Existing blocks are moved by the HDFS mover.
+    required: false
+    default: None
+  recurse:
+    description:
+      - If C(yes), and the path is a directory, C(owner), C(group), C(mode), C(replication) and C(storage_policy) are also enforced on all the files and
+        directories below it. The tree is walked using paged listings, and only entries which differ are modified.
+        Modifications are spread over C(workers) concurrent connections.
+      - C(mode) is applied to both files and directories.
+    required: false
+    default: false
+  workers:
+    description:
+      - Maximum number of WebHDFS calls performed concurrently, for operations involving many paths (Such as C(recurse)).
+    required: false
+    default: 8
   default_owner:
     description:
       - Name of the user that will own the directory in case of creation. Existing directory will not be modified.
@@ -92,8 +241,18 @@ options:
       - Where to find Hadoop configuration file, specially hdfs-site.xml, 
         in order to lookup WebHDFS endpoint (C(dfs.namenode.http-address))
         Used only if webhdfs_endpoint is not defined
+      - The file is parsed incrementally, up to the point where the namenodes of the nameservice are known. The result
+        is cached in C(cache_dir), and reused as long as the file is not modified.
     required: false
     default: "/etc/hadoop/conf"
+  nameservice:
+    description:
+      - When looking up WebHDFS endpoints in hdfs-site.xml, only the namenodes of this nameservice
+        (C(dfs.ha.namenodes.<nameservice>)) are considered.
+      - If not defined, C(dfs.internal.nameservices) is used, or C(dfs.nameservices) if it defines only one
+        nameservice. Otherwise, all C(dfs.namenode.http-address*) values are candidates.
+    required: false
+    default: None
   webhdfs_endpoint:
     description:
       - Provide WebHDFS REST API entry point. Typically C(<namenodeHost>:50070). 
@@ -101,10 +260,61 @@ options:
         If not defined, will be looked up in local hdfs-site.xml
     required: false
     default: None
+  probe_timeout:
+    description:
+      - When the active WebHDFS endpoint is not known, all candidates are probed concurrently. This is the deadline,
+        in seconds, for each probe. A candidate which does not answer in time is considered invalid.
+    required: false
+    default: 10
+  verify:
+    description:
+      - If C(yes), the status of each modified path is fetched again to check the result. If C(no), successful
+        WebHDFS responses are trusted, which saves one call per modified path.
+    required: false
+    default: true
+  retries:
+    description:
+      - Number of times a WebHDFS call is retried when the NameNode answers with a StandbyException, a
+        RetriableException or a 503 code, or can't be reached. On StandbyException or connection error, candidate
+        endpoints are probed again to find the new active NameNode. Only the failed call is retried, so a NameNode
+        failover in the middle of a run does not fail the task.
+    required: false
+    default: 5
+  retry_delay:
+    description:
+      - Base delay, in seconds, between retries. It is doubled on each attempt (Up to 30 seconds), with some random
+        jitter. There is no delay when retrying on a new active endpoint.
+    required: false
+    default: 0.5
   hdfs_user:
-    description: Define account to impersonate to perform required operation on HDFS through WebHDFS.
+    description: 
+      - Define account to impersonate to perform required operation on HDFS through WebHDFS.
+      - Not used for authentication when C(kerberos) is set. It should then match the principal short name, as it is used
+        to locate the trash.
     required: false
     default: "hdfs"
+  kerberos:
+    description:
+      - If C(yes), authenticate to a secured cluster using the Kerberos ticket of the target host user (C(kinit) must
+        have been performed). This requires the C(requests_kerberos) python package.
+      - SPNEGO is performed once, to get a delegation token (C(GETDELEGATIONTOKEN)), which is then used for all calls.
+        The token is cached in C(cache_dir) (Per credential cache) up to its expiration, so following tasks do not
+        contact the KDC at all. A token rejected by the NameNode is dropped, and a new one is requested.
+    required: false
+    default: false
+  cache_dir:
+    description:
+      - Directory, on the target host, where this module keeps its persistent caches, such as the last known active
+        WebHDFS endpoint, or the namenodes found in hdfs-site.xml.
+    required: false
+    default: "~/.ansible/cache/hdfs_file"
+  endpoint_cache_ttl:
+    description:
+      - Number of seconds the last known active WebHDFS endpoint is trusted without probing all candidates again.
+        The cached entry is dropped as soon as this endpoint answers with a StandbyException or can't be reached.
+        Set to 0 to disable the cache.
+    required: false
+    default: 600
 author: 
     - Serge ALEXANDRE
     
@@ -120,6 +330,12 @@ EXAMPLES = '''
 # Remove this folder.
 - hdfs_file: hdfs_path=/user/joe/some_directory state=absent
 
+# Remove a huge folder without locking the NameNode for minutes: No more than 5000 entries per batch, 4 concurrent calls
+- hdfs_file: hdfs_path=/data/old_events state=absent delete_batch_size=5000 delete_pause=0.5 workers=4
+
+# Move a folder to the trash of hdfs user instead of deleting it
+- hdfs_file: hdfs_path=/user/joe/some_directory state=absent trash=yes
+
 # Change permission. Only hdfs user will be able to access this file or folder.
 - hdfs_file: hdfs_path=/user/hdfs/some_file_or_folder owner=hdfs group=hdfs mode=0700
 
@@ -132,41 +348,281 @@ EXAMPLES = '''
 # Ensure the directory exists. If yes, do not touch it. If no, create it with provided default_xxxx values.
 - hdfs_file: hdfs_path=/user/joe/may_exist_directory default_owner=joe default_group=users default_mode=0755 state=directory
 
+# Upload a jar, unless already there with the same content
+- hdfs_file: src=/opt/app/lib/app.jar hdfs_path=/apps/app/lib/app.jar owner=app group=app mode=0644
+
+# Mirror a local library folder into HDFS, removing obsolete jars
+- hdfs_file: src=/opt/app/lib/ hdfs_path=/apps/app/lib owner=app group=app mode=0644 directory_mode=0755 delete=yes
+
+# Give a whole tree to joe, as 'hdfs dfs -chown -R' would do, without launching a JVM
+- hdfs_file: hdfs_path=/user/joe owner=joe group=users recurse=yes
+
+# Speed up a staging load: Single replica on SSD. Then back to 3 replicas once loaded
+- hdfs_file: hdfs_path=/staging/load replication=1 storage_policy=ALL_SSD recurse=yes
+- hdfs_file: hdfs_path=/staging/load replication=3 storage_policy=HOT recurse=yes
+
+# Create a set of tenant directories in one call. Entries inherit group and mode from the module level.
+- hdfs_file:
+    group: tenants
+    mode: 0750
+    state: directory
+    paths:
+      - { hdfs_path: /tenants/acme, owner: acme }
+      - { hdfs_path: /tenants/globex, owner: globex, mode: 0700 }
+      - /tenants/shared
+      - { hdfs_path: /tenants/obsolete, state: absent }
+
+# Same, for a large manifest: One directory listing per parent instead of one status call per path.
+- hdfs_file:
+    paths: "{{ tenant_directories }}"
+    state: directory
+    reconcile: yes
 
+# Gather usage and quota of project directories, reusing values up to one hour old
+- hdfs_file:
+    paths: "{{ projects | map(attribute='path') | list }}"
+    usage: quota_usage
+    usage_cache_ttl: 3600
+- debug: msg="{{ hdfs_usage['/projects/acme'].space_consumed }}"
+
+
+'''
+
+RETURN = '''
+http_calls:
+    description: Number of HTTP calls performed, per WebHDFS operation. PROBE are endpoint lookup calls, CREATE_DATA
+                 are uploads to DataNodes. Retried calls are counted for each attempt.
+    returned: always
+    type: dict
+    sample: { "GETFILESTATUS": 2, "MKDIRS": 1, "SETOWNER": 1 }
+http_time_ms:
+    description: Cumulated duration, in milliseconds, of the HTTP calls, per WebHDFS operation.
+    returned: always
+    type: dict
+    sample: { "GETFILESTATUS": 5, "MKDIRS": 8, "SETOWNER": 3 }
+ansible_facts:
+    description: When C(usage) is set, space usage and quota per path. Quota values are -1 when not set. C(length),
+                 C(files) and C(directories) are only provided by C(content_summary).
+    returned: when usage is set
+    type: dict
+    sample: { "hdfs_usage": { "/projects/acme": { "entries": 1250, "space_consumed": 3221225472, "quota": 100000,
+              "space_quota": 10995116277760, "length": 1073741824, "files": 1200, "directories": 50 } } }
+deleted_entries:
+    description: Number of files and directories deleted, when C(delete_batch_size) is used.
+    returned: when entries were deleted in batches
+    type: int
+    sample: 125000
+results:
+    description: Per path outcome, when C(paths) is used.
+    returned: when paths is provided
+    type: list
+    sample: [ { "hdfs_path": "/tenants/acme", "state": "directory", "changed": true, "failed": false } ]
 '''
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from crc32c import crc32c
+except ImportError:
+    crc32c = None
+
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
 HAS_REQUESTS = False
 
 try:
     import requests
     HAS_REQUESTS = True
-except ImportError, AttributeError:
+except (ImportError, AttributeError):
     # AttributeError if __version__ is not present
     pass
 
+HAS_REQUESTS_KERBEROS = False
+
+try:
+    from requests_kerberos import HTTPKerberosAuth, OPTIONAL
+    HAS_REQUESTS_KERBEROS = True
+except ImportError:
+    pass
+
 # Global, to allow access from error
 module = None
 
+class CallStats:
+    """Count and time HTTP calls, per WebHDFS operation. Also count entries deleted in batches"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.times = {}
+        self.deleted = 0
+
+    def record(self, op, start):
+        elapsed = (time.time() - start) * 1000
+        with self.lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+            self.times[op] = self.times.get(op, 0) + elapsed
+
+    def countDeleted(self, count):
+        with self.lock:
+            self.deleted += count
+
+    def result(self):
+        with self.lock:
+            result = { 'http_calls': dict(self.calls), 'http_time_ms': dict((op, int(round(t))) for (op, t) in self.times.items()) }
+            if self.deleted > 0:
+                result['deleted_entries'] = self.deleted
+            return result
+
+
 class WebHDFS:
-    def __init__(self, endpoint, hdfsUser):
+    def __init__(self, endpoint, hdfsUser, session=None, stats=None):
         self.endpoint = endpoint
+        self.hdfsUser = hdfsUser
         self.auth = "user.name=" + hdfsUser + "&"
+        # Set by lookupWebHdfs() on secured clusters. Then, the session performs SPNEGO on 401 answers
+        self.kerberos = False
+        self.token = None
+        self.tokenCache = None
+        self.tokenLock = threading.Lock()
+        # A single keep-alive session is shared by all calls (And all WebHDFS instances created by lookupWebHdfs())
+        self.session = session if session != None else requests.Session()
+        self.stats = stats if stats != None else CallStats()
+        # Set by lookupWebHdfs()
+        self.cache = None
+        self.cacheKey = None
+        self.candidates = [endpoint]
+        self.probeTimeout = None
+        self.retries = 0
+        self.retryDelay = 0.5
+        # Set to False on first LISTSTATUS_BATCH rejection (Before Hadoop 2.8)
+        self.batchListing = True
+        # Set to False on first GETQUOTAUSAGE rejection (Before Hadoop 3.0)
+        self.quotaUsage = True
+        # Storage policy name => id. Fetched on first use
+        self.storagePolicies = None
+        self.storagePoliciesLock = threading.Lock()
+        # Several workers may hit a failover at the same time
+        self.failoverLock = threading.Lock()
             
-    def test(self):
-        url = "http://{0}/webhdfs/v1/?{1}op=GETFILESTATUS".format(self.endpoint, self.auth)
+    def setToken(self, token):
+        """Use delegation token for all calls. If None, fall back to SPNEGO (kerberos) or pseudo authentication"""
+        self.token = token
+        if token != None:
+            self.auth = "delegation=" + quote(token) + "&"
+        elif self.kerberos:
+            self.auth = ""
+        else:
+            self.auth = "user.name=" + self.hdfsUser + "&"
+
+    def test(self, endpoint, timeout=None):
+        url = "http://{0}/webhdfs/v1/?{1}op=GETFILESTATUS".format(endpoint, self.auth)
+        start = time.time()
         try:
-            resp = requests.get(url)
-            if resp.status_code == 200:
+            resp = self.session.get(url, timeout=timeout)
+            self.stats.record("PROBE", start)
+            # A rejected delegation token will be replaced on first call
+            if resp.status_code == 200 or isInvalidToken(resp):
                 return (True, "")
             else: 
                 return (False, "{0}  =>  Response code: {1}".format(url, resp.status_code))
         except Exception as e:
+            self.stats.record("PROBE", start)
             return (False, "{0}  =>  Response code: {1}".format(url, str(e)))
-        
+
+    def url(self, path, query):
+        return "http://{0}/webhdfs/v1{1}?{2}{3}".format(self.endpoint, path, self.auth, query)
+
+    def call(self, method, path, query, **kwargs):
+        """Perform a WebHDFS call. Return the response, whatever the http code, once not retriable or out of retries.
+        On StandbyException or connection error, switch to the new active endpoint. On InvalidToken, get a new delegation token"""
+        op = query.split("&")[0][len("op="):]
+        attempt = 0
+        while True:
+            (endpoint, token) = (self.endpoint, self.token)
+            url = self.url(path, query)
+            switched = False
+            start = time.time()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+                self.stats.record(op, start)
+            except requests.exceptions.RequestException as e:
+                self.stats.record(op, start)
+                resp = None
+                failure = str(e)
+                switched = self.failover(endpoint)
+            else:
+                if isStandby(resp):
+                    failure = "StandbyException"
+                    switched = self.failover(endpoint)
+                elif isRetriable(resp):
+                    failure = "Response code: {0}".format(resp.status_code)
+                elif isInvalidToken(resp) and token != None:
+                    failure = "InvalidToken"
+                    switched = self.renewToken(token)
+                else:
+                    return resp
+            if attempt >= self.retries:
+                if resp == None:
+                    error("Error when calling '{0}': {1}", url, failure)
+                return resp
+            attempt += 1
+            if not switched:
+                time.sleep(backoffDelay(self.retryDelay, attempt))
+
+    def failover(self, endpoint):
+        """'endpoint' is no longer active. Look for the active one. Return True if we can retry on another endpoint"""
+        with self.failoverLock:
+            if self.endpoint != endpoint:
+                return True    # Already switched by another thread
+            self.invalidateCache()
+            (active, errors) = probeEndpoints(self, self.candidates, self.probeTimeout)
+            if active == None:
+                return False
+            self.endpoint = active
+            if self.cache != None:
+                self.cache.put(self.cacheKey, active)
+            return active != endpoint
+
+    def invalidateCache(self):
+        if self.cache != None:
+            self.cache.invalidate(self.cacheKey)
+
+    def renewToken(self, token):
+        """'token' has been rejected. Drop it and get a new one. Return True if the call can be retried"""
+        with self.tokenLock:
+            if self.token != token:
+                return True    # Already replaced by another thread
+            if self.tokenCache != None:
+                self.tokenCache.invalidate(self.cacheKey)
+            self.setToken(None)
+            self.fetchToken()
+            return True
+
+    def fetchToken(self):
+        """Get a delegation token, using SPNEGO. Its expiration is provided by a renewal. Cache it"""
+        resp = self.call("GET", "/", "op=GETDELEGATIONTOKEN")
+        if resp.status_code != 200:
+            error("Unable to get a delegation token. Invalid returned http code '{0}' when calling '{1}'", resp.status_code, resp.url)
+        token = resp.json()['Token']['urlString']
+        resp = self.call("PUT", "/", "op=RENEWDELEGATIONTOKEN&token=" + quote(token))
+        if resp.status_code == 200:
+            expiration = resp.json()['long'] / 1000.0
+        else:
+            # We are not the renewer. Keep it for a while anyway
+            expiration = time.time() + TokenCache.DEFAULT_LIFETIME
+        if self.tokenCache != None:
+            self.tokenCache.put(self.cacheKey, token, expiration)
+        self.setToken(token)
 
     def getFileStatus(self, path):
-        url = "http://{0}/webhdfs/v1{1}?{2}op=GETFILESTATUS".format(self.endpoint, path, self.auth)
-        resp = requests.get(url)
+        resp = self.call("GET", path, "op=GETFILESTATUS")
         if resp.status_code == 200:
             #print content
             result =  resp.json()
@@ -174,39 +630,371 @@ class WebHDFS:
         elif resp.status_code == 404:
             return None
         else:
-            error("Invalid returned http code '{0}' when calling '{1}'",resp.status_code, url)
+            error("Invalid returned http code '{0}' when calling '{1}'",resp.status_code, resp.url)
+            
+    def listStatus(self, path):
+        """Iterate over the FileStatus of the entries of directory 'path'. Yield nothing if 'path' does not exist.
+        Large directories are fetched page by page, using LISTSTATUS_BATCH if supported by the NameNode"""
+        startAfter = None
+        while True:
+            if not self.batchListing:
+                resp = self.call("GET", path, "op=LISTSTATUS")
+                if resp.status_code == 404:
+                    return
+                if resp.status_code != 200:
+                    error("Invalid returned http code '{0}' when calling '{1}'", resp.status_code, resp.url)
+                for fs in resp.json()['FileStatuses']['FileStatus']:
+                    yield fs
+                return
+            query = "op=LISTSTATUS_BATCH"
+            if startAfter != None:
+                query += "&startafter=" + quote(startAfter.encode("utf-8"))
+            resp = self.call("GET", path, query)
+            if resp.status_code == 404:
+                return
+            if resp.status_code == 400 and startAfter == None:
+                self.batchListing = False
+                continue
+            if resp.status_code != 200:
+                error("Invalid returned http code '{0}' when calling '{1}'", resp.status_code, resp.url)
+            listing = resp.json()['DirectoryListing']
+            statuses = listing['partialListing']['FileStatuses']['FileStatus']
+            for fs in statuses:
+                yield fs
+            if listing['remainingEntries'] == 0 or not statuses:
+                return
+            startAfter = statuses[-1]['pathSuffix']
             
-    def put(self, url):
-        resp = requests.put(url, allow_redirects=False)
+    def getContentSummary(self, path):
+        resp = self.call("GET", path, "op=GETCONTENTSUMMARY")
+        if resp.status_code == 404:
+            return None
+        if resp.status_code != 200:
+            error("Invalid returned http code '{0}' when calling '{1}'", resp.status_code, resp.url)
+        return resp.json()['ContentSummary']
+
+    def getQuotaUsage(self, path):
+        """Return QuotaUsage, or ContentSummary (A superset) if not supported by the NameNode (Before Hadoop 3.0)"""
+        if self.quotaUsage:
+            resp = self.call("GET", path, "op=GETQUOTAUSAGE")
+            if resp.status_code == 400:
+                self.quotaUsage = False
+            elif resp.status_code == 404:
+                return None
+            elif resp.status_code != 200:
+                error("Invalid returned http code '{0}' when calling '{1}'", resp.status_code, resp.url)
+            else:
+                return resp.json()['QuotaUsage']
+        return self.getContentSummary(path)
+
+    def put(self, path, query):
+        resp = self.call("PUT", path, query, allow_redirects=False)
         if resp.status_code != 200:  
-            error("Invalid returned http code '{0}' when calling '{1}'", resp.status_code, url)
+            error("Invalid returned http code '{0}' when calling '{1}'", resp.status_code, resp.url)
 
     def createFolder(self, path, permission):
         if permission != None:
-            url = "http://{0}/webhdfs/v1{1}?{2}op=MKDIRS&permission={3}".format(self.endpoint, path, self.auth, permission)
+            self.put(path, "op=MKDIRS&permission={0}".format(permission))
         else:
-            url = "http://{0}/webhdfs/v1{1}?{2}op=MKDIRS".format(self.endpoint, path, self.auth)
-        self.put(url)
+            self.put(path, "op=MKDIRS")
+
+    def createFile(self, path, src, permission, chunkSize, replication=None):
+        """Upload local file 'src'. The NameNode redirects to a DataNode, where the file content is streamed"""
+        query = "op=CREATE&overwrite=true"
+        if permission != None:
+            query += "&permission={0}".format(permission)
+        if replication != None:
+            query += "&replication={0}".format(replication)
+        attempt = 0
+        while True:
+            resp = self.call("PUT", path, query, allow_redirects=False)
+            if resp.status_code != 307:
+                error("Invalid returned http code '{0}' when calling '{1}'", resp.status_code, resp.url)
+            location = resp.headers['Location']
+            start = time.time()
+            try:
+                try:
+                    with open(src, "rb") as f:
+                        stream = FileStream(f, chunkSize)
+                        # An empty stream would be sent chunked by requests, which needs an iterable
+                        resp = self.session.put(location, data=stream if stream.len > 0 else b"", headers={ 'Content-Type': 'application/octet-stream' })
+                finally:
+                    self.stats.record("CREATE_DATA", start)
+                if resp.status_code == 201:
+                    return
+                failure = "Invalid returned http code '{0}' when calling '{1}'".format(resp.status_code, location)
+                retriable = resp.status_code >= 500
+            except (IOError, OSError) as e:
+                error("Error when reading '{0}': {1}", src, str(e))
+            except requests.exceptions.RequestException as e:
+                failure = "Error when uploading '{0}' to '{1}': {2}".format(src, location, str(e))
+                retriable = True
+            # DataNode failure. Restart from the NameNode, which will redirect to another DataNode
+            if not retriable or attempt >= self.retries:
+                error(failure)
+            attempt += 1
+            time.sleep(backoffDelay(self.retryDelay, attempt))
+
+    def getFileChecksum(self, path):
+        # Redirected to a DataNode
+        resp = self.call("GET", path, "op=GETFILECHECKSUM")
+        if resp.status_code != 200:
+            error("Invalid returned http code '{0}' when calling '{1}'", resp.status_code, resp.url)
+        return resp.json()['FileChecksum']
 
-    def setOwner(self, path, owner):
-        url = "http://{0}/webhdfs/v1{1}?{2}op=SETOWNER&owner={3}".format(self.endpoint, path, self.auth, owner)
-        self.put(url)
+    def setModificationTime(self, path, mtime):
+        self.put(path, "op=SETTIMES&modificationtime={0}".format(mtime))
 
-    def setGroup(self, path, group):
-        url = "http://{0}/webhdfs/v1{1}?{2}op=SETOWNER&group={3}".format(self.endpoint, path, self.auth, group)
-        self.put(url)
+    def setOwner(self, path, owner, group):
+        """Set owner and/or group, in a single call"""
+        query = "op=SETOWNER"
+        if owner != None:
+            query += "&owner={0}".format(owner)
+        if group != None:
+            query += "&group={0}".format(group)
+        self.put(path, query)
     
     def setPermission(self, path, permission):
-        url = "http://{0}/webhdfs/v1{1}?{2}op=SETPERMISSION&permission={3}".format(self.endpoint, path, self.auth, permission)
-        self.put(url)
+        self.put(path, "op=SETPERMISSION&permission={0}".format(permission))
+
+    def setReplication(self, path, replication):
+        self.put(path, "op=SETREPLICATION&replication={0}".format(replication))
+
+    def setStoragePolicy(self, path, policy):
+        self.put(path, "op=SETSTORAGEPOLICY&storagepolicy={0}".format(policy))
+
+    def getStoragePolicyId(self, name):
+        with self.storagePoliciesLock:
+            if self.storagePolicies == None:
+                resp = self.call("GET", "/", "op=GETALLSTORAGEPOLICY")
+                if resp.status_code == 200:
+                    policies = resp.json()['BlockStoragePolicies']['BlockStoragePolicy']
+                    self.storagePolicies = dict((x['name'], x['id']) for x in policies)
+                else:
+                    self.storagePolicies = STORAGE_POLICIES
+        if name not in self.storagePolicies:
+            error("Unknown storage policy '{0}'. Should be one of {1}", name, sorted(self.storagePolicies))
+        return self.storagePolicies[name]
     
     def delete(self, path):
-        url = "http://{0}/webhdfs/v1{1}?{2}op=DELETE&recursive=true".format(self.endpoint, path, self.auth)
-        resp = requests.delete(url)
+        resp = self.call("DELETE", path, "op=DELETE&recursive=true")
         if resp.status_code != 200:  
-            error("Invalid returned http code '{0}' when calling '{1}'", resp.status_code, url)
+            error("Invalid returned http code '{0}' when calling '{1}'", resp.status_code, resp.url)
+
+    def rename(self, path, destination):
+        """Return False if not renamed. As FileSystem.rename(), if destination is an existing directory, path is moved
+        into it"""
+        resp = self.call("PUT", path, "op=RENAME&destination=" + quote(destination.encode("utf-8")), allow_redirects=False)
+        if resp.status_code != 200:
+            error("Invalid returned http code '{0}' when calling '{1}'", resp.status_code, resp.url)
+        return resp.json()['boolean']
+
+
+class FileStream:
+    """File-like object handing a file to requests (And httplib) in fixed size chunks"""
+
+    def __init__(self, f, chunkSize):
+        self.f = f
+        self.chunkSize = chunkSize
+        # Used by requests to set Content-Length
+        self.len = os.fstat(f.fileno()).st_size
+
+    def read(self, size=-1):
+        return self.f.read(self.chunkSize)
+
+
+CRC32C_TABLE = None
+
+
+def pyCrc32c(data):
+    global CRC32C_TABLE
+    if CRC32C_TABLE == None:
+        table = []
+        for i in range(256):
+            crc = i
+            for _ in range(8):
+                crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+            table.append(crc)
+        # Only published once complete, as checksums are computed by concurrent workers
+        CRC32C_TABLE = table
+    crc = 0xFFFFFFFF
+    for b in bytearray(data):
+        crc = CRC32C_TABLE[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def localFileChecksum(src, algorithm, blockSize):
+    """Compute the HDFS MD5-of-MD5-of-CRC checksum of a local file, as it would be if written with 'blockSize'.
+    Return its hex representation (As in GETFILECHECKSUM result), or None if 'algorithm' is not supported"""
+    m = re.match(r"^MD5-of-(\d+)MD5-of-(\d+)(CRC32C?)$", algorithm)
+    if m == None:
+        return None
+    bytesPerCrc = int(m.group(2))
+    if m.group(3) == "CRC32C":
+        crc = crc32c if crc32c != None else pyCrc32c
+    else:
+        crc = lambda data: zlib.crc32(data) & 0xFFFFFFFF
+    # Read by pieces of a multiple of bytesPerCrc. HDFS block size is always such a multiple.
+    pieceSize = bytesPerCrc * 2048
+    size = os.path.getsize(src)
+    md5OfMd5s = hashlib.md5()
+    with open(src, "rb") as f:
+        remaining = size
+        while remaining > 0:
+            blockMd5 = hashlib.md5()
+            inBlock = min(blockSize, remaining)
+            while inBlock > 0:
+                piece = f.read(min(pieceSize, inBlock))
+                if not piece:
+                    error("Unexpected end of file '{0}'", src)
+                for i in range(0, len(piece), bytesPerCrc):
+                    blockMd5.update(struct.pack(">I", crc(piece[i:i + bytesPerCrc])))
+                inBlock -= len(piece)
+                remaining -= len(piece)
+            md5OfMd5s.update(blockMd5.digest())
+    crcPerBlock = blockSize // bytesPerCrc if size > blockSize else 0
+    return binascii.hexlify(struct.pack(">iq", bytesPerCrc, crcPerBlock) + md5OfMd5s.digest()).decode("ascii")
+
+
+def remoteException(resp):
+    """Return the Java exception name of a WebHDFS error response, or None"""
+    try:
+        return resp.json()['RemoteException']['exception']
+    except Exception:
+        return None
+
+
+def isStandby(resp):
+    return resp.status_code == 403 and (remoteException(resp) or "").endswith("StandbyException")
+
+
+def isInvalidToken(resp):
+    return resp.status_code in (401, 403) and (remoteException(resp) or "").endswith("InvalidToken")
+
+
+def isRetriable(resp):
+    return resp.status_code == 503 or (resp.status_code == 403 and (remoteException(resp) or "").endswith("RetriableException"))
+
+
+def backoffDelay(base, attempt):
+    """Exponential backoff, with jitter so concurrent workers don't retry in lockstep"""
+    return min(base * (2 ** (attempt - 1)), 30) * random.uniform(0.5, 1.5)
+
+
+class JsonFile:
+    """A small json document, persisted on the target host. Concurrent writers are safe: last one wins"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save(self, entries):
+        # Write to a temporary file, then rename, so concurrent tasks never read a partial file. Failing to save is not an error
+        try:
+            folder = os.path.dirname(self.path)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            (fd, tmp) = tempfile.mkstemp(dir=folder)
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            pass
+
+
+class EndpointCache(JsonFile):
+    """Last known active WebHDFS endpoint, per nameservice"""
+
+    def __init__(self, cacheDir, ttl):
+        JsonFile.__init__(self, os.path.join(os.path.expanduser(cacheDir), "endpoints.json"))
+        self.ttl = ttl
+
+    def load(self):
+        if self.ttl <= 0:
+            return {}
+        return JsonFile.load(self)
+
+    def get(self, key):
+        entry = self.load().get(key)
+        if entry != None and time.time() - entry['timestamp'] < self.ttl:
+            return entry['endpoint']
+        return None
+
+    def put(self, key, endpoint):
+        if self.ttl <= 0:
+            return
+        entries = self.load()
+        entries[key] = { 'endpoint': endpoint, 'timestamp': time.time() }
+        self.save(entries)
+
+    def invalidate(self, key):
+        entries = self.load()
+        if key in entries:
+            del entries[key]
+            self.save(entries)
         
             
+class UsageCache(JsonFile):
+    """Values gathered by 'usage', per nameservice, operation and path"""
+
+    def __init__(self, cacheDir, ttl):
+        JsonFile.__init__(self, os.path.join(os.path.expanduser(cacheDir), "usage.json"))
+        self.ttl = ttl
+        self.entries = JsonFile.load(self) if ttl > 0 else {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry != None and time.time() - entry['timestamp'] < self.ttl:
+            return entry['usage']
+        return None
+
+    def putAll(self, values):
+        """Store all values, and drop expired entries, in a single write"""
+        if self.ttl <= 0:
+            return
+        now = time.time()
+        entries = dict((k, v) for (k, v) in JsonFile.load(self).items() if now - v['timestamp'] < self.ttl)
+        for (key, usage) in values.items():
+            entries[key] = { 'usage': usage, 'timestamp': now }
+        self.save(entries)
+
+
+class TokenCache(JsonFile):
+    """Delegation tokens, per nameservice and Kerberos credential cache. Holds secrets: Only readable by its owner, as
+    created by mkstemp()"""
+    # Seconds. Tokens expiring sooner are not reused
+    MARGIN = 300
+    DEFAULT_LIFETIME = 3600
+
+    def __init__(self, cacheDir):
+        JsonFile.__init__(self, os.path.join(os.path.expanduser(cacheDir), "tokens.json"))
+        self.credentials = os.environ.get("KRB5CCNAME", "uid:{0}".format(os.getuid()))
+
+    def get(self, key):
+        entry = self.load().get(self.credentials + "|" + key)
+        if entry != None and entry['expiration'] - time.time() > TokenCache.MARGIN:
+            return entry['token']
+        return None
+
+    def put(self, key, token, expiration):
+        now = time.time()
+        entries = dict((k, v) for (k, v) in self.load().items() if v['expiration'] > now)
+        entries[self.credentials + "|" + key] = { 'token': token, 'expiration': expiration }
+        self.save(entries)
+
+    def invalidate(self, key):
+        entries = self.load()
+        if self.credentials + "|" + key in entries:
+            del entries[self.credentials + "|" + key]
+            self.save(entries)
+
+
 class State:
     FILE = "file"
     ABSENT = "absent"
@@ -217,32 +1005,147 @@ class HdfsType:
     DIRECTORY = "DIRECTORY"
 
 
+class HdfsError(Exception):
+    pass
+
+
 def error(message, *args):
+    # Raised up to main(), which will fail the module. In 'paths' mode, this only fail the current entry.
     x = "" + message.format(*args)
-    module.fail_json(msg = x)    
+    raise HdfsError(x)
 
 
 class Parameters:
     changed = False
 
 
-def checkAndAdjustAttributes(webhdfs, fileStatus, p):
-    if p.owner != None and p.owner != fileStatus['owner']:
-        p.changed = True
-        if not p.check_mode: 
-            webhdfs.setOwner(p.path, p.owner)
-    if p.group != None and p.group != fileStatus['group']:
+# Per path options. Also allowed as keys of a 'paths' entry
+PATH_OPTIONS = ['state', 'src', 'owner', 'group', 'mode', 'replication', 'storage_policy', 'directory_mode', 'delete', 'recurse', 'default_owner', 'default_group', 'default_mode']
+
+# Used if GETALLSTORAGEPOLICY is not supported (Before Hadoop 2.9)
+STORAGE_POLICIES = { 'HOT': 7, 'COLD': 2, 'WARM': 5, 'ALL_SSD': 12, 'ONE_SSD': 10, 'LAZY_PERSIST': 15, 'PROVIDED': 1 }
+
+
+class WorkerPool:
+    """Run functions on a fixed number of threads. submit() blocks when all workers are busy and a few calls are 
+    already pending, so a producer walking a huge tree never holds more than that in memory.
+    Errors are collected, and returned by join()"""
+    MAX_ERRORS = 20
+
+    def __init__(self, size):
+        self.size = max(size, 1)
+        self.tasks = queue.Queue(maxsize=self.size * 2)
+        self.lock = threading.Lock()
+        self.errors = []
+        self.errorCount = 0
+        self.threads = []
+        for _ in range(self.size):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self):
+        while True:
+            task = self.tasks.get()
+            if task == None:
+                return
+            (function, args) = task
+            try:
+                function(*args)
+            except Exception as e:
+                with self.lock:
+                    self.errorCount += 1
+                    if len(self.errors) < WorkerPool.MAX_ERRORS:
+                        self.errors.append(str(e))
+            finally:
+                self.tasks.task_done()
+
+    def submit(self, function, *args):
+        self.tasks.put((function, args))
+
+    def wait(self):
+        """Wait for all submitted calls to complete. The pool can still be used afterward"""
+        self.tasks.join()
+
+    def join(self):
+        """Wait for all submitted calls to complete. Return the list of errors (Up to MAX_ERRORS), and the error count"""
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+        return (self.errors, self.errorCount)
+
+
+def execute(function, *args):
+    function(*args)
+
+
+def adjustAttributes(webhdfs, path, fileStatus, p, run, inherited=False):
+    """Compare fileStatus with wanted owner, group, mode, replication and storage policy. Use run(function, *args) to
+    perform the needed modifications. If inherited, path is below p.path, and does not need its own storage policy"""
+    owner = p.owner if p.owner != None and p.owner != fileStatus['owner'] else None
+    group = p.group if p.group != None and p.group != fileStatus['group'] else None
+    if owner != None or group != None:
         p.changed = True
         if not p.check_mode: 
-            webhdfs.setGroup(p.path, p.group)
+            run(webhdfs.setOwner, path, owner, group)
     if(p.mode != None and fileStatus['permission'] != p.mode):
         p.changed = True
         if not p.check_mode: 
-            webhdfs.setPermission(p.path, p.mode)
+            run(webhdfs.setPermission, path, p.mode)
+    if p.replication != None and fileStatus['type'] == HdfsType.FILE and fileStatus['replication'] != p.replication:
+        p.changed = True
+        if not p.check_mode:
+            run(webhdfs.setReplication, path, p.replication)
+    if p.storagePolicy != None:
+        # 0: Unspecified. Inherited from parent
+        policy = fileStatus.get('storagePolicy', 0)
+        if policy != webhdfs.getStoragePolicyId(p.storagePolicy) and not (inherited and policy == 0):
+            p.changed = True
+            if not p.check_mode:
+                run(webhdfs.setStoragePolicy, path, p.storagePolicy)
+
+
+def walkTree(webhdfs, path):
+    """Iterate over (path, FileStatus) of all entries below 'path'. As listings are consumed page by page, memory
+    usage depends on the tree depth, not on its size"""
+    stack = [(path, webhdfs.listStatus(path))]
+    while stack:
+        (folder, entries) = stack[-1]
+        fs = next(entries, None)
+        if fs == None:
+            stack.pop()
+            continue
+        child = posixpath.join(folder, fs['pathSuffix'])
+        yield (child, fs)
+        # childrenNum is not provided by old NameNodes
+        if fs['type'] == HdfsType.DIRECTORY and fs.get('childrenNum', -1) != 0:
+            stack.append((child, webhdfs.listStatus(child)))
+
+
+def adjustTreeAttributes(webhdfs, p):
+    pool = WorkerPool(p.workers)
+    try:
+        for (path, fs) in walkTree(webhdfs, p.path):
+            adjustAttributes(webhdfs, path, fs, p, pool.submit, True)
+    finally:
+        (errors, errorCount) = pool.join()
+    if errorCount > 0:
+        error("{0} error(s) while adjusting attributes below {1}: {2}", errorCount, p.path, errors)
+
+
+def checkAndAdjustAttributes(webhdfs, fileStatus, p):
+    adjustAttributes(webhdfs, p.path, fileStatus, p, execute)
+    if p.recurse and fileStatus['type'] == HdfsType.DIRECTORY:
+        adjustTreeAttributes(webhdfs, p)
 
 
 def checkCompletion(webhdfs, p):
-    fs = webhdfs.getFileStatus(p.path)
+    checkStatus(webhdfs, webhdfs.getFileStatus(p.path), p)
+
+
+def checkStatus(webhdfs, fs, p):
     if fs == None:
         if p.state != State.ABSENT :
             error("Was unable to create {0}", p.path)
@@ -256,108 +1159,250 @@ def checkCompletion(webhdfs, p):
                 error("Was unable to switch owner to {0}. Still {1}", p.owner, fs['owner']) 
             if p.group != None and fs['group'] != p.group:
                 error("Was unable to switch group to {0}. Still {1}", p.group, fs['group']) 
-            if p.mode != None and fs['permission'] != p.mode:
-                error("Was unable to switch permission to {0}. Still {1}", p.mode, fs['permission']) 
+            mode = p.mode
+            if p.src != None and fs['type'] == HdfsType.DIRECTORY:
+                # A mirrored tree. 'mode' is for files
+                mode = p.directoryMode
+            if mode != None and fs['permission'] != mode:
+                error("Was unable to switch permission to {0}. Still {1}", mode, fs['permission']) 
+            if p.replication != None and fs['type'] == HdfsType.FILE and fs['replication'] != p.replication:
+                error("Was unable to switch replication to {0}. Still {1}", p.replication, fs['replication'])
+            if p.storagePolicy != None and fs.get('storagePolicy', 0) != webhdfs.getStoragePolicyId(p.storagePolicy):
+                error("Was unable to switch storage policy to {0}. Still {1}", p.storagePolicy, fs.get('storagePolicy', 0))
                 
                 
+def usageFacts(usage):
+    """Compact view of a ContentSummary or a QuotaUsage"""
+    if usage == None:
+        return None
+    facts = { 'space_consumed': usage['spaceConsumed'], 'quota': usage['quota'], 'space_quota': usage['spaceQuota'] }
+    if 'fileCount' in usage:
+        facts['entries'] = usage['fileCount'] + usage['directoryCount']
+        facts['length'] = usage['length']
+        facts['files'] = usage['fileCount']
+        facts['directories'] = usage['directoryCount']
+    else:
+        facts['entries'] = usage['fileAndDirectoryCount']
+    return facts
+
+
+def gatherUsage(webhdfs, paths, p):
+    """Return usage facts of all paths, queried concurrently. Fresh enough values are taken from cache"""
+    cache = UsageCache(p.cacheDir, p.usageCacheTtl)
+    function = webhdfs.getContentSummary if p.usage == "content_summary" else webhdfs.getQuotaUsage
+    facts = {}
+    fetched = {}
+    def fetch(path, key):
+        fetched[key] = facts[path] = usageFacts(function(path))
+    pool = WorkerPool(p.workers)
+    try:
+        for path in paths:
+            key = "{0}|{1}|{2}".format(webhdfs.cacheKey, p.usage, path)
+            cached = cache.get(key)
+            if cached != None:
+                facts[path] = cached
+            elif path not in facts:
+                facts[path] = None
+                pool.submit(fetch, path, key)
+    finally:
+        (errors, errorCount) = pool.join()
+    if errorCount > 0:
+        error("{0} error(s) while gathering usage: {1}", errorCount, errors)
+    # Missing paths are not cached
+    cache.putAll(dict((key, usage) for (key, usage) in fetched.items() if usage != None))
+    return facts
+
+
+def probeEndpoints(webhdfs, candidates, timeout):
+    """Probe all candidates concurrently, with webhdfs session and credentials, and return (activeEndpoint, errors) as
+    soon as one is active. activeEndpoint is None if no candidate is valid"""
+    answers = queue.Queue()
+    def probe(endpoint):
+        (x, err) = webhdfs.test(endpoint, timeout)
+        answers.put((endpoint, x, err))
+    for endpoint in candidates:
+        # Daemon threads: A hung probe must not prevent the module to exit once an active endpoint is found
+        thread = threading.Thread(target=probe, args=(endpoint,))
+        thread.daemon = True
+        thread.start()
+    errors = []
+    pending = list(candidates)
+    # requests timeout apply to connection and each read. Allow some margin before giving up on a probe
+    deadline = time.time() + timeout + 1 if timeout != None else None
+    while pending:
+        try:
+            (endpoint, x, err) = answers.get(timeout=max(deadline - time.time(), 0) if deadline != None else None)
+        except queue.Empty:
+            break
+        pending.remove(endpoint)
+        if x:
+            return (endpoint, errors)
+        errors.append(err)
+    for endpoint in pending:
+        errors.append("{0}  =>  No answer within {1} seconds".format(endpoint, timeout))
+    return (None, errors)
+
+
+NN_HTTP_TOKEN1 = "dfs.namenode.http-address"
+NN_HTTP_TOKEN2 = "dfs.http.address"  # Deprecated
+NAMESERVICES = "dfs.nameservices"
+INTERNAL_NAMESERVICES = "dfs.internal.nameservices"
+HA_NAMENODES = "dfs.ha.namenodes."
+
+
+def splitList(value):
+    return [x.strip() for x in (value or "").split(",") if x.strip()]
+
+
+def resolveNamenodes(properties, nameservice):
+    """From the (ordered) list of (name, value) hdfs-site.xml properties collected so far, return (nameservice, candidates, complete).
+    complete is True when more properties could not change the result"""
+    values = dict(properties)
+    explicit = nameservice != None
+    if nameservice == None:
+        internal = splitList(values.get(INTERNAL_NAMESERVICES))
+        nameservices = splitList(values.get(NAMESERVICES))
+        if internal:
+            nameservice = internal[0]
+        elif len(nameservices) == 1:
+            nameservice = nameservices[0]
+    if nameservice != None:
+        namenodes = splitList(values.get(HA_NAMENODES + nameservice))
+        if namenodes:
+            keys = ["{0}.{1}.{2}".format(NN_HTTP_TOKEN1, nameservice, nn) for nn in namenodes]
+            candidates = [values[key] for key in keys if key in values]
+            return (nameservice, candidates, len(candidates) == len(keys))
+        key = "{0}.{1}".format(NN_HTTP_TOKEN1, nameservice)
+        if key in values:
+            # Federated, but not H.A.
+            return (nameservice, [values[key]], False)
+        if explicit:
+            return (nameservice, [], False)
+    # No usable nameservice. All defined addresses are candidates
+    candidates = [value for (name, value) in properties if name.startswith(NN_HTTP_TOKEN1) or name.startswith(NN_HTTP_TOKEN2)]
+    return (None, candidates, False)
+
+
+def parseHdfsSite(hspath, nameservice):
+    """Incrementally parse hdfs-site.xml, keeping only namenodes related properties, and stop as soon as the namenodes
+    of the nameservice are all known. Return (nameservice, candidates)"""
+    properties = []
+    try:
+        for (event, elem) in ElementTree.iterparse(hspath):
+            if elem.tag != "property":
+                continue
+            name = (elem.findtext("name") or "").strip()
+            if name.startswith(NN_HTTP_TOKEN1) or name.startswith(NN_HTTP_TOKEN2) or name.startswith(HA_NAMENODES) or name in (NAMESERVICES, INTERNAL_NAMESERVICES):
+                properties.append((name, (elem.findtext("value") or "").strip()))
+                if resolveNamenodes(properties, nameservice)[2]:
+                    break
+            elem.clear()
+    except (ElementTree.ParseError, IOError, OSError) as e:
+        error("Unable to parse {0}: {1}", hspath, str(e))
+    (nameservice, candidates, complete) = resolveNamenodes(properties, nameservice)
+    return (nameservice, candidates)
+
+
+def lookupHdfsSite(p):
+    """Return (nameservice, candidates) from hdfs-site.xml. Cached as long as the file is not modified"""
+    hspath = os.path.join(p.hadoopConfDir, "hdfs-site.xml")
+    if not os.path.isfile(hspath):
+        error("Unable to find file {0}. Provide 'webhdfs_endpoint' or 'hadoop_conf_dir' parameter", hspath)
+    stat = os.stat(hspath)
+    cache = JsonFile(os.path.join(os.path.expanduser(p.cacheDir), "hdfs-site.json"))
+    entries = cache.load()
+    version = "{0}:{1!r}:{2}:".format(os.path.abspath(hspath), stat.st_mtime, stat.st_size)
+    key = version + (p.nameservice or "")
+    if key in entries:
+        return (entries[key]['nameservice'], entries[key]['candidates'])
+    (nameservice, candidates) = parseHdfsSite(hspath, p.nameservice)
+    if not candidates:
+        if p.nameservice != None:
+            error("Unable to find namenodes of nameservice '{0}' in {1}. Provide explicit 'webhdfs_endpoint'", p.nameservice, hspath)
+        error("Unable to find {0}* or {1}* in {2}. Provide explicit 'webhdfs_endpoint'", NN_HTTP_TOKEN1, NN_HTTP_TOKEN2, hspath)
+    # Drop entries of previous versions of this file
+    entries = dict((k, v) for (k, v) in entries.items() if k.startswith(version) or not k.startswith(os.path.abspath(hspath) + ":"))
+    entries[key] = { 'nameservice': nameservice, 'candidates': candidates }
+    cache.save(entries)
+    return (nameservice, candidates)
+
+
 def lookupWebHdfs(p):                
+    session = requests.Session()
+    # Allow one kept-alive connection per worker
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(p.workers, 1)))
     if p.webhdfsEndpoint == None:
-        candidates = []
-        hspath = os.path.join(p.hadoopConfDir, "hdfs-site.xml")
-        NN_HTTP_TOKEN1 = "dfs.namenode.http-address"
-        NN_HTTP_TOKEN2 = "dfs.http.address"  # Deprecated
-        if os.path.isfile(hspath):
-            doc = minidom.parse(hspath)
-            properties = doc.getElementsByTagName("property")
-            for prop in properties :
-                name = prop.getElementsByTagName("name")[0].childNodes[0].data
-                if name.startswith(NN_HTTP_TOKEN1) or name.startswith(NN_HTTP_TOKEN2):
-                    candidates.append(prop.getElementsByTagName("value")[0].childNodes[0].data)
-            if not candidates:
-                error("Unable to find {0}* or {1}* in {2}. Provide explicit 'webhdfs_endpoint'", NN_HTTP_TOKEN1, NN_HTTP_TOKEN2, hspath)
-            errors = []
-            for endpoint in candidates:
-                webHDFS= WebHDFS(endpoint, p.hdfsUser)
-                (x, err) = webHDFS.test()
-                if x:
-                    p.webhdfsEndpoint = webHDFS.endpoint
-                    return webHDFS
-                else:
-                    errors.append(err)
-            error("Unable to find a valid 'webhdfs_endpoint' in hdfs-site.xml:" + str(errors))
-        else:
-            error("Unable to find file {0}. Provide 'webhdfs_endpoint' or 'hadoop_conf_dir' parameter", hspath)
+        (nameservice, candidates) = lookupHdfsSite(p)
     else:
+        nameservice = p.nameservice
         candidates = p.webhdfsEndpoint.split(",")
-        errors = []
-        for endpoint in candidates:
-            webHDFS= WebHDFS(endpoint, p.hdfsUser)
-            (x, err) = webHDFS.test()
-            if x:
-                p.webhdfsEndpoint = webHDFS.endpoint
-                return webHDFS
-            else:
-                errors.append(err)
-        error("Unable to find a valid 'webhdfs_endpoint' in: " + p.webhdfsEndpoint + " (" + str(errors) + ")")
-    
-                
-def main():
-    
-    global module
-    module = AnsibleModule(
-        argument_spec = dict(
-            state = dict(required=False, choices=['file','directory','absent']),
-            hdfs_path  = dict(required=True),
-            owner = dict(required=False),
-            group = dict(required=False),
-            mode = dict(required=False),
-            default_owner = dict(required=False),
-            default_group = dict(required=False),
-            default_mode = dict(required=False),
-            hadoop_conf_dir = dict(required=False, default="/etc/hadoop/conf"),
-            webhdfs_endpoint = dict(required=False, default=None),
-            hdfs_user = dict(required=False, default="hdfs")
-        ),
-        supports_check_mode=True
-    )
-    
-    if not HAS_REQUESTS:
-        module.fail_json(msg="python-requests module is not installed")    
 
+    # Without nameservice name, the set of namenodes identify it
+    cache = EndpointCache(p.cacheDir, p.endpointCacheTtl)
+    cacheKey = nameservice if nameservice != None else ",".join(sorted(candidates))
+    webHDFS = WebHDFS(None, p.hdfsUser, session, p.stats)
+    if p.kerberos:
+        session.auth = HTTPKerberosAuth(mutual_authentication=OPTIONAL)
+        webHDFS.kerberos = True
+        webHDFS.tokenCache = TokenCache(p.cacheDir)
+        webHDFS.setToken(webHDFS.tokenCache.get(cacheKey))
+    webHDFS.endpoint = cache.get(cacheKey)
+    if webHDFS.endpoint not in candidates:
+        (webHDFS.endpoint, errors) = probeEndpoints(webHDFS, candidates, p.probeTimeout)
+        if webHDFS.endpoint == None:
+            if p.webhdfsEndpoint == None:
+                error("Unable to find a valid 'webhdfs_endpoint' in hdfs-site.xml:" + str(errors))
+            else:
+                error("Unable to find a valid 'webhdfs_endpoint' in: " + p.webhdfsEndpoint + " (" + str(errors) + ")")
+        cache.put(cacheKey, webHDFS.endpoint)
+    webHDFS.cache = cache
+    webHDFS.cacheKey = cacheKey
+    webHDFS.candidates = candidates
+    webHDFS.probeTimeout = p.probeTimeout
+    webHDFS.retries = p.retries
+    webHDFS.retryDelay = p.retryDelay
+    p.webhdfsEndpoint = webHDFS.endpoint
+    if p.kerberos and webHDFS.token == None:
+        webHDFS.fetchToken()
+    return webHDFS
     
-    p = Parameters()
-    p.state = module.params['state']
-    p.path = module.params['hdfs_path']
-    p.owner = module.params['owner']
-    p.group = module.params['group']
-    p.mode = module.params['mode']
-    p.default_owner = module.params['default_owner']
-    p.default_group = module.params['default_group']
-    p.default_mode = module.params['default_mode']
-    p.hadoopConfDir = module.params['hadoop_conf_dir']
-    p.webhdfsEndpoint = module.params['webhdfs_endpoint']
-    p.hdfsUser = module.params['hdfs_user']
-    p.check_mode = module.check_mode
 
-    if p.mode != None:
-        if not isinstance(p.mode, int):
+def normalizeMode(mode, name):
+    if mode != None:
+        if not isinstance(mode, int):
             try:
-                p.mode = int(p.mode, 8)
+                mode = int(mode, 8)
             except Exception:
-                error("mode must be in octal form")
+                error("{0} must be in octal form", name)
     
-        p.mode = oct(p.mode).lstrip("0")
-        #print '{ mode_type: "' + str(type(p.mode)) + '",  mode_value: "' + str(p.mode) + '"}'
+        mode = "{0:o}".format(mode)
+        #print '{ mode_type: "' + str(type(mode)) + '",  mode_value: "' + str(mode) + '"}'
+    return mode
 
-    if p.default_mode != None:
-        if not isinstance(p.default_mode, int):
-            try:
-                p.default_mode = int(p.default_mode, 8)
-            except Exception:
-                error("default_mode must be in octal form")
-    
-        p.default_mode = oct(p.default_mode).lstrip("0")
 
+def setPathParameters(p, values):
+    p.state = values['state']
+    p.path = values['hdfs_path']
+    p.src = values['src']
+    p.owner = values['owner']
+    p.group = values['group']
+    p.mode = normalizeMode(values['mode'], "mode")
+    p.replication = values['replication']
+    if p.replication != None:
+        try:
+            p.replication = int(p.replication)
+        except ValueError:
+            error("Invalid replication '{0}' for path '{1}'", p.replication, p.path)
+    p.storagePolicy = values['storage_policy'].upper() if values['storage_policy'] != None else None
+    p.directoryMode = normalizeMode(values['directory_mode'], "directory_mode")
+    p.delete = values['delete']
+    p.recurse = values['recurse']
+    p.default_owner = values['default_owner']
+    p.default_group = values['default_group']
+    p.default_mode = normalizeMode(values['default_mode'], "default_mode")
+
+    if p.state != None and p.state not in [State.FILE, State.DIRECTORY, State.ABSENT]:
+        error("Invalid state '{0}' for path '{1}'", p.state, p.path)
     if(p.owner != None and p.default_owner != None):
         error("There is no reason to define both owner and default_owner")
     if(p.group != None and p.default_group != None):
@@ -365,17 +1410,292 @@ def main():
     if(p.mode != None and p.default_mode != None):
         error("There is no reason to define both mode and default_mode")
 
-    if not p.path.startswith("/"):
+    if p.path == None or not p.path.startswith("/"):
         error("Path '{0}' is not absolute. Absolute path is required!", p.path)
+    if p.replication != None and p.replication < 1:
+        error("Invalid replication '{0}' for path '{1}'", p.replication, p.path)
 
-    webhdfs = lookupWebHdfs(p)
-    
-    fileStatus = webhdfs.getFileStatus(p.path)
+    if p.src != None:
+        p.src = os.path.expanduser(p.src)
+        if os.path.isdir(p.src):
+            if p.state == None:
+                p.state = State.DIRECTORY
+            if p.state != State.DIRECTORY:
+                error("'src' is a directory. It can only be used with state 'directory', not '{0}'", p.state)
+            if p.default_owner != None or p.default_group != None or p.default_mode != None:
+                error("default_owner, default_group and default_mode can't be used when 'src' is a directory")
+        elif os.path.isfile(p.src):
+            if p.state == None:
+                p.state = State.FILE
+            if p.state != State.FILE:
+                error("'src' is a file. It can only be used with state 'file', not '{0}'", p.state)
+        else:
+            error("Source '{0}' does not exist", p.src)
+
+
+def buildEntryParameters(entry, globalParams, check_mode):
+    """Build the Parameters of a 'paths' entry. Options not set in the entry are inherited from module level"""
+    p = Parameters()
+    p.check_mode = check_mode
+    p.workers = globalParams['workers']
+    p.verify = globalParams['verify']
+    p.deleteBatchSize = globalParams['delete_batch_size']
+    p.deletePause = globalParams['delete_pause']
+    p.trash = globalParams['trash']
+    p.compare = globalParams['compare']
+    p.chunkSize = globalParams['chunk_size']
+    if isinstance(entry, dict):
+        for key in entry:
+            if key != 'hdfs_path' and key not in PATH_OPTIONS:
+                error("Invalid key '{0}' in paths entry {1}", key, entry)
+        values = {}
+        for key in PATH_OPTIONS:
+            values[key] = entry[key] if entry.get(key) != None else globalParams[key]
+        values['hdfs_path'] = entry.get('hdfs_path')
+    else:
+        values = dict((key, globalParams[key]) for key in PATH_OPTIONS)
+        values['hdfs_path'] = entry
+    setPathParameters(p, values)
+    return p
+
+
+def isSameFile(webhdfs, path, src, fileStatus, p):
+    stat = os.stat(src)
+    if fileStatus['length'] != stat.st_size:
+        return False
+    if p.compare == "checksum":
+        if stat.st_size == 0:
+            # HDFS checksum of an empty file is a constant (MD5-of-0MD5-of-0CRC32), not derived from a block
+            return True
+        remote = webhdfs.getFileChecksum(path)
+        local = localFileChecksum(src, remote['algorithm'], fileStatus['blockSize'])
+        if local != None:
+            return local == remote['bytes'].lower()
+    return fileStatus['modificationTime'] // 1000 == int(stat.st_mtime)
+
+
+def uploadFile(webhdfs, path, src, fileStatus, p):
+    """Upload src, and set owner, group, mode and replication. When replacing a file, preserve its attributes if not
+    specified"""
     if fileStatus == None:
+        (owner, group, mode, replication) = (p.default_owner, p.default_group, p.default_mode, None)
+    else:
+        (owner, group, mode, replication) = (fileStatus['owner'], fileStatus['group'], fileStatus['permission'], fileStatus['replication'])
+    owner = p.owner if p.owner != None else owner
+    group = p.group if p.group != None else group
+    mode = p.mode if p.mode != None else mode
+    replication = p.replication if p.replication != None else replication
+    p.changed = True
+    if not p.check_mode:
+        webhdfs.createFile(path, src, mode, p.chunkSize, replication)
+        webhdfs.setModificationTime(path, int(os.path.getmtime(src) * 1000))
+        if owner != None or group != None:
+            webhdfs.setOwner(path, owner, group)
+        setInitialStoragePolicy(webhdfs, path, p)
+
+
+def setInitialStoragePolicy(webhdfs, path, p):
+    """On a created path. Below p.path, the storage policy is inherited"""
+    if p.storagePolicy != None and path == p.path:
+        # Check the name first, for a meaningful error
+        webhdfs.getStoragePolicyId(p.storagePolicy)
+        webhdfs.setStoragePolicy(path, p.storagePolicy)
+
+
+def syncFile(webhdfs, path, src, fileStatus, p):
+    if fileStatus == None or not isSameFile(webhdfs, path, src, fileStatus, p):
+        uploadFile(webhdfs, path, src, fileStatus, p)
+    else:
+        adjustAttributes(webhdfs, path, fileStatus, p, execute, True)
+
+
+def makeFolder(webhdfs, path, p):
+    p.changed = True
+    if not p.check_mode:
+        webhdfs.createFolder(path, p.mode)
+        if p.owner != None or p.group != None:
+            webhdfs.setOwner(path, p.owner, p.group)
+        setInitialStoragePolicy(webhdfs, path, p)
+
+
+def deletePath(webhdfs, path, fileStatus, p):
+    p.changed = True
+    if p.check_mode:
+        return
+    if p.trash:
+        moveToTrash(webhdfs, path)
+    elif p.deleteBatchSize != None and fileStatus['type'] == HdfsType.DIRECTORY and fileStatus.get('childrenNum', -1) != 0:
+        TreeDeleter(webhdfs, p).run(path)
+    else:
+        webhdfs.delete(path)
+
+
+def moveToTrash(webhdfs, path):
+    """Move path under the trash of the hdfs user, as 'hdfs dfs -rm' does. If already there, add a timestamp suffix"""
+    trash = "/user/{0}/.Trash/Current".format(webhdfs.hdfsUser)
+    if path.rstrip("/") == "" or (path.rstrip("/") + "/").startswith(trash + "/"):
+        error("Can't move '{0}' to trash", path)
+    destination = trash + path.rstrip("/")
+    webhdfs.createFolder(posixpath.dirname(destination), "700")
+    # RENAME moves path into destination if it is an existing directory, instead of failing
+    if webhdfs.getFileStatus(destination) != None:
+        destination = destination + str(int(time.time() * 1000))
+    if not webhdfs.rename(path, destination):
+        error("Unable to move '{0}' to trash '{1}'", path, trash)
+
+
+class TreeDeleter:
+    """Delete a tree bottom-up, so that no DELETE call removes more than batchSize entries.
+    The tree is walked depth first. Entries of a directory are accumulated up to batchSize, then deleted concurrently
+    (Each one being a file, or a small enough sub-tree). A directory whose remaining content fits in a batch is deleted
+    with a single call, as part of its parent batch"""
+    REPORT_INTERVAL = 10
+
+    def __init__(self, webhdfs, p):
+        self.webhdfs = webhdfs
+        self.batchSize = max(p.deleteBatchSize, 1)
+        self.pause = p.deletePause
+        self.workers = p.workers
+        self.deleted = 0
+        self.lastReport = time.time()
+
+    def run(self, path):
+        self.pool = WorkerPool(self.workers)
+        try:
+            remaining = self.deleteContent(path)
+            self.webhdfs.delete(path)
+            self.count(path, remaining + 1)
+        finally:
+            (errors, errorCount) = self.pool.join()
+        if errorCount > 0:
+            error("{0} error(s) while deleting '{1}': {2}", errorCount, path, errors)
+
+    def deleteContent(self, folder):
+        """Delete the content of folder, up to the point where what remains fits in a batch, with folder itself.
+        Return the number of remaining entries"""
+        pending = []
+        pendingSize = 0
+        for fs in self.webhdfs.listStatus(folder):
+            child = posixpath.join(folder, fs['pathSuffix'])
+            size = 1
+            # childrenNum is not provided by old NameNodes
+            if fs['type'] == HdfsType.DIRECTORY and fs.get('childrenNum', -1) != 0:
+                size += self.deleteContent(child)
+            if pendingSize + size > self.batchSize:
+                self.flush(folder, pending, pendingSize)
+                (pending, pendingSize) = ([], 0)
+            pending.append(child)
+            pendingSize += size
+        if pendingSize + 1 > self.batchSize:
+            self.flush(folder, pending, pendingSize)
+            (pending, pendingSize) = ([], 0)
+        return pendingSize
+
+    def flush(self, folder, paths, size):
+        for path in paths:
+            self.pool.submit(self.webhdfs.delete, path)
+        self.pool.wait()
+        if self.pool.errorCount > 0:
+            (errors, errorCount) = (self.pool.errors, self.pool.errorCount)
+            error("{0} error(s) while deleting content of '{1}': {2}", errorCount, folder, errors)
+        self.count(folder, size)
+        if self.pause > 0:
+            time.sleep(self.pause)
+
+    def count(self, folder, size):
+        self.deleted += size
+        self.webhdfs.stats.countDeleted(size)
+        if time.time() - self.lastReport >= TreeDeleter.REPORT_INTERVAL:
+            self.lastReport = time.time()
+            if module != None:
+                module.log("hdfs_file: {0} entries deleted so far. Now in '{1}'".format(self.deleted, folder))
+
+
+def syncTree(webhdfs, fileStatus, p):
+    """Mirror local directory p.src into p.path. The HDFS tree is listed once, then all modifications are performed
+    by a WorkerPool"""
+    if fileStatus != None and fileStatus['type'] != HdfsType.DIRECTORY:
+        error("Path '{0}' is a file. Can't convert to a directory", p.path)
+    # 'mode' apply to files. Use a copy of the parameters, with directory_mode, for directories
+    dirParams = copy.copy(p)
+    dirParams.mode = p.directoryMode
+    root = p.path.rstrip("/")
+
+    remote = {}
+    if fileStatus == None:
+        makeFolder(webhdfs, p.path, dirParams)
+    else:
+        adjustAttributes(webhdfs, p.path, fileStatus, dirParams, execute)
+        for (path, fs) in walkTree(webhdfs, p.path):
+            remote[path[len(root) + 1:]] = fs
+
+    localDirs = set()
+    localFiles = {}
+    for (folder, dirs, files) in os.walk(p.src):
+        relFolder = os.path.relpath(folder, p.src).replace(os.sep, "/")
+        prefix = "" if relFolder == "." else relFolder + "/"
+        for name in dirs:
+            localDirs.add(prefix + name)
+        for name in files:
+            localFiles[prefix + name] = os.path.join(folder, name)
+
+    pool = WorkerPool(p.workers)
+    try:
+        # Remove what is not in src (Only the top of removed trees), or has not the same type.
+        deleted = set()
+        for rel in sorted(remote):
+            fs = remote[rel]
+            parent = posixpath.dirname(rel)
+            while parent != "" and parent not in deleted:
+                parent = posixpath.dirname(parent)
+            if parent != "":
+                continue     # Already removed, with one of its parents
+            isDir = fs['type'] == HdfsType.DIRECTORY
+            if (isDir and rel in localDirs) or (not isDir and rel in localFiles):
+                continue
+            if rel in localFiles or rel in localDirs:
+                if not p.delete:
+                    error("Path '{0}/{1}' is not of the same type in HDFS and in '{2}'. Use 'delete' to replace it", root, rel, p.src)
+            elif not p.delete:
+                continue
+            deleted.add(rel)
+            pool.submit(deletePath, webhdfs, root + "/" + rel, fs, p)
+        pool.wait()
+        for rel in deleted:
+            del remote[rel]
+        # Directories are created depth by depth, parent first. Otherwise MKDIRS would create missing parents with default attributes
+        byDepth = {}
+        for rel in localDirs:
+            if rel in remote:
+                pool.submit(adjustAttributes, webhdfs, root + "/" + rel, remote[rel], dirParams, execute, True)
+            else:
+                byDepth.setdefault(rel.count("/"), []).append(rel)
+        for depth in sorted(byDepth):
+            for rel in byDepth[depth]:
+                pool.submit(makeFolder, webhdfs, root + "/" + rel, dirParams)
+            pool.wait()
+        for rel in localFiles:
+            pool.submit(syncFile, webhdfs, root + "/" + rel, localFiles[rel], remote.get(rel), p)
+    finally:
+        (errors, errorCount) = pool.join()
+        p.changed = p.changed or dirParams.changed
+    if errorCount > 0:
+        error("{0} error(s) while synchronizing '{1}' to '{2}': {3}", errorCount, p.src, p.path, errors)
+
+
+def applyState(webhdfs, fileStatus, p):
+    if p.src != None and p.state == State.DIRECTORY:
+        syncTree(webhdfs, fileStatus, p)
+    elif p.src != None and (fileStatus == None or fileStatus['type'] == HdfsType.FILE):
+        if fileStatus == None or not isSameFile(webhdfs, p.path, p.src, fileStatus, p):
+            uploadFile(webhdfs, p.path, p.src, fileStatus, p)
+        else:
+            checkAndAdjustAttributes(webhdfs, fileStatus, p)
+    elif fileStatus == None:
         if p.state == State.ABSENT:
             pass    # Fine. Nothing to do
         elif p.state != State.DIRECTORY:
-            error("This module can only create Folder. State should be 'directory' and not '{0}'", p.state)
+            error("This module can only create Folder, or File from 'src'. State should be 'directory' and not '{0}'", p.state)
         else:
             p.changed = True
             if not p.check_mode:
@@ -383,17 +1703,14 @@ def main():
                 group = p.default_group if p.group is None else p.group
                 mode = p.default_mode if p.mode is None else p.mode
                 webhdfs.createFolder(p.path, mode)
-                if owner != None:
-                    webhdfs.setOwner(p.path, owner)
-                if group != None:
-                    webhdfs.setGroup(p.path, group)
+                if owner != None or group != None:
+                    webhdfs.setOwner(p.path, owner, group)
+                setInitialStoragePolicy(webhdfs, p.path, p)
     else:
         if p.state == None:
             checkAndAdjustAttributes(webhdfs, fileStatus, p)
         elif p.state == State.ABSENT:
-            p.changed = True
-            if not p.check_mode:
-                webhdfs.delete(p.path)
+            deletePath(webhdfs, p.path, fileStatus, p)
         elif p.state == State.FILE and fileStatus['type'] == HdfsType.DIRECTORY:
             error("Path '{0}' is a directory. Can't convert to a file", p.path)
         elif p.state == State.DIRECTORY and fileStatus['type'] == HdfsType.FILE:
@@ -404,11 +1721,231 @@ def main():
             checkAndAdjustAttributes(webhdfs, fileStatus, p)
         else:
             error("State mismatch: Requested:{0}  HDFS:{1}", p.state, fileStatus['type'])
-    
-    if not p.check_mode:
+
+
+def processPath(webhdfs, p):
+    fileStatus = webhdfs.getFileStatus(p.path)
+    applyState(webhdfs, fileStatus, p)
+    if p.changed and p.verify and not p.check_mode:
         checkCompletion(webhdfs, p)    
+
+
+def processPaths(webhdfs, entries):
+    """Handle all 'paths' entries. An error on one entry is recorded in its result, and does not stop the others"""
+    results = []
+    for (entry, p, err) in entries:
+        if p == None:
+            results.append({ 'hdfs_path': entry, 'changed': False, 'failed': True, 'msg': err })
+            continue
+        result = { 'hdfs_path': p.path, 'state': p.state, 'changed': False, 'failed': False }
+        try:
+            processPath(webhdfs, p)
+        except HdfsError as e:
+            result['failed'] = True
+            result['msg'] = str(e)
+        result['changed'] = p.changed
+        results.append(result)
+    return results
+
+
+def reconcilePaths(webhdfs, entries, check_mode, verify):
+    """Handle all 'paths' entries with one listing per parent directory, instead of one GETFILESTATUS per path (And
+    another one in checkCompletion()). An error on one entry is recorded in its result, and does not stop the others"""
+    results = []
+    byParent = {}
+    for (entry, p, err) in entries:
+        if p == None:
+            results.append({ 'hdfs_path': entry, 'changed': False, 'failed': True, 'msg': err })
+            continue
+        result = { 'hdfs_path': p.path, 'state': p.state, 'changed': False, 'failed': False }
+        results.append(result)
+        path = p.path.rstrip("/")
+        if path == "":
+            # Root has no parent to list
+            try:
+                processPath(webhdfs, p)
+            except HdfsError as e:
+                result['failed'] = True
+                result['msg'] = str(e)
+            result['changed'] = p.changed
+        else:
+            byParent.setdefault(posixpath.dirname(path), []).append((posixpath.basename(path), p, result))
+
+    # Parents are handled top down, so the content of a directory created or deleted in this run is known without listing it.
+    emptyDirs = set()
+    changedParents = []
+    for parent in sorted(byParent, key=lambda x: (x.rstrip("/").count("/"), x)):
+        children = byParent[parent]
+        statuses = {}
+        try:
+            if parent not in emptyDirs:
+                wanted = set(name for (name, p, result) in children)
+                for fs in webhdfs.listStatus(parent):
+                    # Only keep what we need. A parent may be huge
+                    if fs['pathSuffix'] in wanted:
+                        statuses[fs['pathSuffix']] = fs
+        except HdfsError as e:
+            for (name, p, result) in children:
+                result['failed'] = True
+                result['msg'] = str(e)
+            continue
+        for (name, p, result) in children:
+            fileStatus = statuses.get(name)
+            try:
+                applyState(webhdfs, fileStatus, p)
+                if p.state == State.ABSENT or (fileStatus == None and p.state == State.DIRECTORY):
+                    emptyDirs.add(p.path.rstrip("/"))
+            except HdfsError as e:
+                result['failed'] = True
+                result['msg'] = str(e)
+            result['changed'] = p.changed
+        if any(p.changed for (name, p, result) in children):
+            changedParents.append(parent)
+
+    if verify and not check_mode:
+        for parent in changedParents:
+            children = [(name, p, result) for (name, p, result) in byParent[parent] if p.changed and not result['failed']]
+            try:
+                wanted = set(name for (name, p, result) in children)
+                statuses = dict((fs['pathSuffix'], fs) for fs in webhdfs.listStatus(parent) if fs['pathSuffix'] in wanted)
+            except HdfsError as e:
+                statuses = None
+                listingError = str(e)
+            for (name, p, result) in children:
+                try:
+                    if statuses == None:
+                        raise HdfsError(listingError)
+                    checkStatus(webhdfs, statuses.get(name), p)
+                except HdfsError as e:
+                    result['failed'] = True
+                    result['msg'] = str(e)
+    return results
+
+                
+def main():
+    
+    global module
+    module = AnsibleModule(
+        argument_spec = dict(
+            state = dict(required=False, choices=['file','directory','absent']),
+            hdfs_path  = dict(required=False),
+            paths = dict(required=False, type='list'),
+            owner = dict(required=False),
+            group = dict(required=False),
+            mode = dict(required=False),
+            replication = dict(required=False, type='int'),
+            storage_policy = dict(required=False),
+            src = dict(required=False),
+            directory_mode = dict(required=False),
+            delete = dict(required=False, type='bool', default=False),
+            compare = dict(required=False, choices=['checksum', 'size_mtime'], default='checksum'),
+            delete_batch_size = dict(required=False, type='int', default=None),
+            delete_pause = dict(required=False, type='float', default=0),
+            trash = dict(required=False, type='bool', default=False),
+            chunk_size = dict(required=False, type='int', default=1048576),
+            recurse = dict(required=False, type='bool', default=False),
+            workers = dict(required=False, type='int', default=8),
+            default_owner = dict(required=False),
+            default_group = dict(required=False),
+            default_mode = dict(required=False),
+            hadoop_conf_dir = dict(required=False, default="/etc/hadoop/conf"),
+            nameservice = dict(required=False, default=None),
+            webhdfs_endpoint = dict(required=False, default=None),
+            probe_timeout = dict(required=False, type='float', default=10),
+            verify = dict(required=False, type='bool', default=True),
+            retries = dict(required=False, type='int', default=5),
+            retry_delay = dict(required=False, type='float', default=0.5),
+            hdfs_user = dict(required=False, default="hdfs"),
+            kerberos = dict(required=False, type='bool', default=False),
+            cache_dir = dict(required=False, default="~/.ansible/cache/hdfs_file"),
+            endpoint_cache_ttl = dict(required=False, type='int', default=600),
+            reconcile = dict(required=False, type='bool', default=False),
+            usage = dict(required=False, choices=['content_summary', 'quota_usage'], default=None),
+            usage_cache_ttl = dict(required=False, type='int', default=0)
+        ),
+        required_one_of = [ ['hdfs_path', 'paths'] ],
+        mutually_exclusive = [ ['hdfs_path', 'paths'], ['src', 'paths'] ],
+        supports_check_mode=True
+    )
+    
+    if not HAS_REQUESTS:
+        module.fail_json(msg="python-requests module is not installed")    
+
+    if module.params['kerberos'] and not HAS_REQUESTS_KERBEROS:
+        module.fail_json(msg="python requests_kerberos module is required when 'kerberos' is set")
+
+    
+    p = Parameters()
+    p.hadoopConfDir = module.params['hadoop_conf_dir']
+    p.nameservice = module.params['nameservice']
+    p.webhdfsEndpoint = module.params['webhdfs_endpoint']
+    p.probeTimeout = module.params['probe_timeout']
+    p.verify = module.params['verify']
+    p.deleteBatchSize = module.params['delete_batch_size']
+    p.deletePause = module.params['delete_pause']
+    p.trash = module.params['trash']
+    p.retries = module.params['retries']
+    p.retryDelay = module.params['retry_delay']
+    p.workers = module.params['workers']
+    p.compare = module.params['compare']
+    p.chunkSize = module.params['chunk_size']
+    p.hdfsUser = module.params['hdfs_user']
+    p.kerberos = module.params['kerberos']
+    p.cacheDir = module.params['cache_dir']
+    p.endpointCacheTtl = module.params['endpoint_cache_ttl']
+    p.check_mode = module.check_mode
+    p.stats = CallStats()
+    p.usage = module.params['usage']
+    p.usageCacheTtl = module.params['usage_cache_ttl']
+
+    if module.params['reconcile'] and module.params['paths'] == None:
+        module.fail_json(msg="'reconcile' can only be used with 'paths'")
+
+    if p.usage != None:
+        for option in ['state', 'src', 'owner', 'group', 'mode', 'replication', 'storage_policy', 'directory_mode', 'default_owner', 'default_group', 'default_mode']:
+            if module.params[option] != None:
+                module.fail_json(msg="'{0}' can't be used with 'usage'".format(option))
+        for option in ['recurse', 'delete', 'reconcile']:
+            if module.params[option]:
+                module.fail_json(msg="'{0}' can't be used with 'usage'".format(option))
+
+    try:
+        if p.usage != None:
+            if module.params['paths'] == None:
+                paths = [module.params['hdfs_path']]
+            else:
+                paths = [entry.get('hdfs_path') if isinstance(entry, dict) else entry for entry in module.params['paths']]
+            for path in paths:
+                if path == None or not path.startswith("/"):
+                    error("Path '{0}' is not absolute. Absolute path is required!", path)
+            webhdfs = lookupWebHdfs(p)
+            facts = gatherUsage(webhdfs, paths, p)
+            module.exit_json(changed=False, ansible_facts={ 'hdfs_usage': facts }, **p.stats.result())
+        elif module.params['paths'] == None:
+            setPathParameters(p, module.params)
+            webhdfs = lookupWebHdfs(p)
+            processPath(webhdfs, p)
+        else:
+            entries = []
+            for entry in module.params['paths']:
+                try:
+                    entries.append((entry, buildEntryParameters(entry, module.params, p.check_mode), None))
+                except HdfsError as e:
+                    entries.append((entry.get('hdfs_path') if isinstance(entry, dict) else entry, None, str(e)))
+            webhdfs = lookupWebHdfs(p)
+            if module.params['reconcile']:
+                results = reconcilePaths(webhdfs, entries, p.check_mode, p.verify)
+            else:
+                results = processPaths(webhdfs, entries)
+            changed = any(r['changed'] for r in results)
+            failed = [r for r in results if r['failed']]
+            if failed:
+                module.fail_json(msg="{0} of {1} path(s) failed".format(len(failed), len(results)), changed=changed, results=results, **p.stats.result())
+            module.exit_json(changed=changed, results=results, **p.stats.result())
+    except HdfsError as e:
+        module.fail_json(msg=str(e), **p.stats.result())
     
-    module.exit_json(changed=p.changed)
+    module.exit_json(changed=p.changed, **p.stats.result())
 
 from ansible.module_utils.basic import *
 if __name__ == '__main__':
@@ -19,6 +19,12 @@ options:
     default: null
     description:
       - The path and filename of the resource(s) definition file.
+      - Also a directory (its *.yml, *.yaml and *.json files, not recursively) or a list of files and directories.
+        Their objects are then processed by waves, in this order, Namespaces, CustomResourceDefinitions,
+        configuration (ServiceAccounts, Secrets, ConfigMaps, RBAC, storage, Services), then everything else.
+        Objects of a wave are processed in parallel, and its CustomResourceDefinitions must be established
+        before the next wave. Deletion is done in the reverse order.
+      - With kubectl, this requires PyYAML. Otherwise all files are given to a single kubectl command.
   kubectl:
     required: false
     default: null
@@ -49,6 +55,7 @@ options:
     default: false
     description:
       - A flag to indicate to force delete, replace, or stop.
+        With applied, take ownership of fields managed by other field managers (--force-conflicts).
   all:
     required: false
     default: false
@@ -59,18 +66,83 @@ options:
     default: 0
     description:
       - Indicates the level of verbosity of logging by kubectl.
+  backend:
+    required: false
+    choices: ['kubectl', 'api']
+    default: kubectl
+    description:
+      - How to talk to the cluster. kubectl forks a kubectl process for each operation.
+        api uses the kubernetes python client, with a single connection pool and API discovery
+        (cached on disk) for all operations of the task. The kubeconfig (or in-cluster config) is read once.
+      - With api, when only filename is provided, existence is checked on the objects defined in the file.
+        stopped deletes the resources with foreground propagation.
+      - Falls back to kubectl if the kubernetes python client (>= 19.0.0, for server side apply) is not installed.
+      - With both, existence checks and label selections are answered from a single list of each kind
+        and namespace involved, instead of one get per object. With kubectl and PyYAML, when only
+        filename is provided, existence is also checked on the objects defined in the file(s).
+        After a kubectl command modifying objects, these lists are done again in full when next needed.
+        With api, the objects written by the module are updated in them instead.
+      - With filename, absent and stopped only delete the objects which still exist, the others are skipped.
   state:
     required: false
-    choices: ['present', 'absent', 'latest', 'reloaded', 'stopped']
+    choices: ['present', 'absent', 'latest', 'reloaded', 'stopped', 'applied']
     default: present
     description:
       - present handles checking existence or creating if definition file provided,
         absent handles deleting resource(s) based on other options,
         latest handles creating ore updating based on existence,
         reloaded handles updating resource(s) definition using definition file,
-        stopped handles stopping resource(s) based on other options.
+        stopped handles stopping resource(s) based on other options,
+        applied handles creating or updating using server-side apply of the definition file,
+        in one request per object. Objects are updated in place, never deleted and recreated.
+      - applied reports a change only for objects created or actually modified by the server, whose
+        resourceVersion changed (kubectl >= 1.18 required). With kubectl, this requires PyYAML,
+        otherwise objects are always reported as applied.
+      - Objects written from filename are stamped with the hash of their definition, in the
+        kube.ansible.com/manifest-sha256 annotation. reloaded and latest fetch the live objects once and
+        skip the ones holding the same hash, even with force. With kubectl, this requires PyYAML.
+  field_manager:
+    required: false
+    default: ansible
+    description:
+      - The field manager name used by applied. Fields set by other managers are left untouched.
+  workers:
+    required: false
+    default: 5
+    description:
+      - Maximum number of objects of a wave processed at once (kubectl processes or API requests).
+  cache_dir:
+    required: false
+    default: "~/.ansible/cache/kube"
+    description:
+      - Discovery and HTTP cache directory given to all kubectl commands (--cache-dir), shared by all tasks.
+  cache_ttl:
+    required: false
+    default: 600
+    description:
+      - Number of seconds the discovery cache of cache_dir is trusted, for a given cluster. The first task
+        finding it older refreshes it once (kubectl api-resources), other tasks running at the same time wait
+        for it, and reuse it. Set to 0 to leave the cache expiration to kubectl.
+      - When the refresh fails (cluster unreachable), it is tried again after 30 seconds at most.
+  wait:
+    required: false
+    default: false
+    description:
+      - With present, latest, reloaded and applied, wait for the Deployments, StatefulSets, DaemonSets
+        and Jobs of filename to be rolled out (Jobs to complete), as kubectl rollout status.
+        StatefulSets and DaemonSets with the OnDelete update strategy are not waited for.
+      - With the api backend, workloads are followed through watches (one per kind and namespace), and
+        their pods and revisions (ReplicaSets, ControllerRevisions) through watches scoped by their selector.
+        The task fails as soon as a pod of the current version (from its pod-template-hash or
+        controller-revision-hash label) is in CrashLoopBackOff or ImagePullBackOff. With kubectl, kubectl rollout status (kubectl wait for Jobs) is run
+        for each workload, this requires PyYAML.
+  wait_timeout:
+    required: false
+    default: 300
+    description:
+      - Number of seconds to wait for the rollout, when wait is set.
 requirements:
-  - kubectl
+  - kubectl, or the kubernetes python client (>= 19.0.0) and PyYAML for the api backend
 author: "Kenny Jones (@kenjones-cisco)"
 """
 
@@ -86,11 +158,424 @@ EXAMPLES = """
 
 - name: test nginx is present
   kube: filename=/tmp/nginx.yml
+
+- name: test nginx is present, without forking kubectl
+  kube: filename=/tmp/nginx.yml backend=api
+
+- name: test nginx is up to date, without restarting pods when nothing changed
+  kube: filename=/tmp/nginx.yml state=applied backend=api
+
+- name: nginx is up to date and rolled out
+  kube: filename=/tmp/nginx.yml state=applied backend=api wait=yes wait_timeout=600
+
+- name: all manifests of the stack are up to date
+  kube:
+    filename:
+      - /tmp/stack/namespace.yml
+      - /tmp/stack/manifests
+    state: applied
+    backend: api
+    workers: 10
 """
 
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    # python 2
+    import Queue as queue
+
+try:
+    import yaml
+    HAS_YAML = True
+except ImportError:
+    HAS_YAML = False
+
+try:
+    from kubernetes import __version__ as KUBERNETES_VERSION, client, config
+    from kubernetes.dynamic import DynamicClient
+    from kubernetes.dynamic.exceptions import NotFoundError
+    from kubernetes.dynamic.resource import ResourceList
+    # DynamicClient.server_side_apply() appeared in 19.0.0
+    HAS_KUBERNETES = int(KUBERNETES_VERSION.split('.')[0]) >= 19
+except ImportError:
+    HAS_KUBERNETES = False
+
+MANIFEST_EXTENSIONS = ('.yml', '.yaml', '.json')
+
+HASH_ANNOTATION = 'kube.ansible.com/manifest-sha256'
+
+WORKLOADS = ('Deployment', 'StatefulSet', 'DaemonSet', 'Job')
+
+# Objects recording the versions of a workload, labeled with the hash of the pods of each version
+REVISIONS = {'Deployment': ('apps/v1', 'ReplicaSet', 'pod-template-hash'),
+             'DaemonSet': ('apps/v1', 'ControllerRevision', 'controller-revision-hash')}
+
+# Container waiting reasons failing a wait early
+FAILURE_REASONS = ['CrashLoopBackOff', 'ImagePullBackOff', 'InvalidImageName', 'ErrImageNeverPull']
+
+# Objects are created in this order, one wave after the other, and deleted in the reverse order.
+# Kinds not listed (workloads, custom resources...) are in the last wave.
+WAVES = [
+    ['Namespace'],
+    ['CustomResourceDefinition'],
+    ['ServiceAccount', 'Secret', 'ConfigMap', 'Role', 'ClusterRole', 'RoleBinding', 'ClusterRoleBinding',
+     'StorageClass', 'PersistentVolume', 'PersistentVolumeClaim', 'ResourceQuota', 'LimitRange',
+     'PriorityClass', 'Service'],
+]
+
+# Seconds to wait for the CustomResourceDefinitions of a wave to be served, before the next wave
+ESTABLISH_TIMEOUT = 60
+
+
+def manifest_files(filenames):
+    """Expand directories (not recursively) to the manifests they contain, in name order"""
+    result = []
+    for filename in filenames:
+        if os.path.isdir(filename):
+            result.extend(sorted(os.path.join(filename, x) for x in os.listdir(filename)
+                                 if x.endswith(MANIFEST_EXTENSIONS)))
+        else:
+            result.append(filename)
+    return result
+
+
+def load_manifests(module, filenames):
+    """All documents of all manifests. Lists (kind: List, ConfigMapList...) are expanded to their items"""
+    documents = []
+    for filename in manifest_files(filenames):
+        try:
+            with open(filename) as f:
+                for document in yaml.safe_load_all(f):
+                    if not document:
+                        continue
+                    if document.get('kind', '').endswith('List') and 'items' in document:
+                        documents.extend(document['items'] or [])
+                    else:
+                        documents.append(document)
+        except (IOError, yaml.YAMLError) as exc:
+            module.fail_json(msg='unable to read %s: %s' % (filename, str(exc)))
+    if not documents:
+        module.fail_json(msg='no resource definition found in %s' % ', '.join(filenames))
+    for document in documents:
+        fingerprint(document)
+    return documents
+
+
+def fingerprint(document):
+    """Stamp the hash of the document content in its annotations"""
+    metadata = document.setdefault('metadata', {})
+    metadata['annotations'] = dict(metadata.get('annotations') or {})
+    metadata['annotations'].pop(HASH_ANNOTATION, None)
+    content = json.dumps(document, sort_keys=True, separators=(',', ':'), default=str)
+    metadata['annotations'][HASH_ANNOTATION] = hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def manifest_hash(obj):
+    """Hash stamped by fingerprint() in a document or live object (as a dict), or None"""
+    return ((obj.get('metadata') or {}).get('annotations') or {}).get(HASH_ANNOTATION)
+
+
+def split_waves(documents, reverse=False):
+    """Group documents per wave (see WAVES), keeping the manifest order within a wave"""
+    waves = [[] for _ in range(len(WAVES) + 1)]
+    for document in documents:
+        index = len(WAVES)
+        for (i, kinds) in enumerate(WAVES):
+            if document.get('kind') in kinds:
+                index = i
+        waves[index].append(document)
+    waves = [x for x in waves if x]
+    if reverse:
+        waves.reverse()
+    return waves
+
+
+def run_parallel(function, items, workers):
+    """Call function on each item, with at most 'workers' threads.
+    Return the results (in items order) and the messages of the raised exceptions."""
+    results = [None] * len(items)
+    errors = []
+    lock = threading.Lock()
+    tasks = queue.Queue()
+    for task in enumerate(items):
+        tasks.put(task)
+
+    def work():
+        while True:
+            try:
+                (index, item) = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = function(item)
+            except Exception as exc:
+                with lock:
+                    errors.append(str(exc))
+
+    threads = [threading.Thread(target=work) for _ in range(max(1, min(workers, len(items))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (results, errors)
+
+
+def fail_objects(module, errors, result):
+    """Report the objects that failed in a wave, along with what was done before"""
+    module.fail_json(msg='%d object(s) failed: %s' % (len(errors), '; '.join(errors)),
+                     changed=bool(result), result=result)
+
+
+def parse_selector(selector):
+    """(label, operator, values) terms of a label selector. Operators are =, !=, in, notin, exists and !"""
+    terms = []
+    for term in re.findall(r'(?:[^,(]|\([^)]*\))+', selector or ''):
+        term = term.strip()
+        match = re.match(r'^(\S+)\s+(in|notin)\s*\((.*)\)$', term)
+        if match:
+            terms.append((match.group(1), match.group(2), set(x.strip() for x in match.group(3).split(','))))
+        elif term.startswith('!'):
+            terms.append((term[1:].strip(), '!', None))
+        elif '!=' in term:
+            (label, value) = term.split('!=', 1)
+            terms.append((label.strip(), '!=', set([value.strip()])))
+        elif '=' in term:
+            (label, value) = term.replace('==', '=').split('=', 1)
+            terms.append((label.strip(), '=', set([value.strip()])))
+        elif term:
+            terms.append((term, 'exists', None))
+    return terms
+
+
+def match_selector(labels, terms):
+    for (label, operator, values) in terms:
+        if operator == 'exists' and label not in labels:
+            return False
+        if operator == '!' and label in labels:
+            return False
+        if operator in ('=', 'in') and labels.get(label) not in values:
+            return False
+        if operator in ('!=', 'notin') and labels.get(label) in values:
+            return False
+    return True
+
+
+def selector_terms(selector):
+    """Terms of a LabelSelector (matchLabels and matchExpressions), as returned by parse_selector()"""
+    terms = [(label, '=', set([value])) for (label, value) in (selector.get('matchLabels') or {}).items()]
+    operators = {'In': 'in', 'NotIn': 'notin', 'Exists': 'exists', 'DoesNotExist': '!'}
+    for expression in selector.get('matchExpressions') or []:
+        terms.append((expression['key'], operators[expression['operator']], set(expression.get('values') or [])))
+    return terms
+
+
+def selector_string(selector):
+    """Label selector string of a LabelSelector (matchLabels and matchExpressions)"""
+    terms = []
+    for (label, operator, values) in sorted(selector_terms(selector)):
+        if operator == '=':
+            terms.append('%s=%s' % (label, list(values)[0]))
+        elif operator in ('in', 'notin'):
+            terms.append('%s %s (%s)' % (label, operator, ','.join(sorted(values))))
+        elif operator == 'exists':
+            terms.append(label)
+        else:
+            terms.append('!' + label)
+    return ','.join(terms)
+
+
+def workload_selector(obj):
+    """LabelSelector of the pods of a workload. Pods of Jobs without selector are labeled with the Job name"""
+    spec = obj.get('spec') or {}
+    if spec.get('selector'):
+        return spec['selector']
+    if obj.get('kind') == 'Job':
+        return {'matchLabels': {'job-name': obj['metadata']['name']}}
+    return {'matchLabels': ((spec.get('template') or {}).get('metadata') or {}).get('labels') or {}}
+
+
+def rollout_status(kind, obj):
+    """(done, failure message) of a workload, from its live version, with the rules of kubectl rollout status"""
+    spec = obj.get('spec') or {}
+    status = obj.get('status') or {}
+    conditions = dict((x['type'], x) for x in status.get('conditions') or [])
+    if kind == 'Job':
+        if conditions.get('Failed', {}).get('status') == 'True':
+            return (False, conditions['Failed'].get('message') or 'job failed')
+        return (conditions.get('Complete', {}).get('status') == 'True', None)
+    if status.get('observedGeneration', 0) < obj['metadata'].get('generation', 0):
+        return (False, None)
+    if kind in ('StatefulSet', 'DaemonSet') and (spec.get('updateStrategy') or {}).get('type') == 'OnDelete':
+        # Pods are only replaced when deleted: nothing to wait for
+        return (True, None)
+    if kind == 'Deployment':
+        if conditions.get('Progressing', {}).get('reason') == 'ProgressDeadlineExceeded':
+            return (False, conditions['Progressing'].get('message') or 'progress deadline exceeded')
+        updated = status.get('updatedReplicas', 0)
+        return (updated >= spec.get('replicas', 1) and status.get('replicas', 0) <= updated and
+                status.get('availableReplicas', 0) >= updated, None)
+    if kind == 'StatefulSet':
+        partition = ((spec.get('updateStrategy') or {}).get('rollingUpdate') or {}).get('partition', 0)
+        return (status.get('readyReplicas', 0) >= spec.get('replicas', 1) and
+                status.get('updatedReplicas', 0) >= spec.get('replicas', 1) - partition, None)
+    desired = status.get('desiredNumberScheduled', 0)
+    return (status.get('updatedNumberScheduled', 0) >= desired and status.get('numberAvailable', 0) >= desired, None)
+
+
+def pod_failure(pod):
+    """'<reason>: <message>' of a container of the pod waiting for one of FAILURE_REASONS, or None"""
+    status = pod.get('status') or {}
+    for container in (status.get('initContainerStatuses') or []) + (status.get('containerStatuses') or []):
+        waiting = (container.get('state') or {}).get('waiting') or {}
+        if waiting.get('reason') in FAILURE_REASONS:
+            return '%s: %s' % (waiting['reason'], waiting.get('message', ''))
+    return None
+
+
+def current_revision(kind, obj, revisions):
+    """(label, value) of the pods of the current version of a workload: the updateRevision of a StatefulSet,
+    the hash of the ReplicaSet of the current revision of a Deployment, of the newest ControllerRevision
+    of a DaemonSet. None if not known yet"""
+    metadata = obj['metadata']
+    if kind == 'StatefulSet':
+        revision = (obj.get('status') or {}).get('updateRevision')
+        return ('controller-revision-hash', revision) if revision else None
+    (_, _, label) = REVISIONS[kind]
+    owned = [x for x in revisions if x['metadata'].get('namespace') == metadata.get('namespace') and
+             any(y.get('uid') == metadata.get('uid') for y in x['metadata'].get('ownerReferences') or [])]
+    if kind == 'Deployment':
+        revision = (metadata.get('annotations') or {}).get('deployment.kubernetes.io/revision')
+        owned = [x for x in owned if revision and
+                 (x['metadata'].get('annotations') or {}).get('deployment.kubernetes.io/revision') == revision]
+    if not owned:
+        return None
+    value = (max(owned, key=lambda x: x.get('revision', 0))['metadata'].get('labels') or {}).get(label)
+    return (label, value) if value else None
+
+
+def workload_failure(kind, obj, pods, revisions):
+    """Failure of a workload, or of one of its pods of the current version (see current_revision()), or None"""
+    (done, failure) = rollout_status(kind, obj)
+    if failure or done:
+        return failure
+    current = None
+    if kind != 'Job':
+        # All pods of a Job are from its single version
+        if (obj.get('status') or {}).get('observedGeneration', 0) < obj['metadata'].get('generation', 0):
+            return None
+        current = current_revision(kind, obj, revisions)
+        if current is None:
+            return None
+    terms = selector_terms(workload_selector(obj))
+    for pod in pods:
+        labels = pod['metadata'].get('labels') or {}
+        if pod['metadata'].get('namespace') != obj['metadata'].get('namespace') or not match_selector(labels, terms):
+            continue
+        if current is not None and labels.get(current[0]) != current[1]:
+            # Previous version, being replaced
+            continue
+        failure = pod_failure(pod)
+        if failure:
+            return 'pod %s: %s' % (pod['metadata']['name'], failure)
+    return None
+
+
+class Snapshot(object):
+    """Objects of one kind in one namespace (or all namespaces), from a single list call,
+    indexed by name and labels, to answer all existence and selector queries.
+    Once marked stale, the list is done again in full on the next query: there is no incremental refresh
+    from its resourceVersion."""
+
+    def __init__(self, lister):
+        self.lister = lister
+        self.lock = threading.Lock()
+        self.objects = None  # (namespace, name) -> object, as a dict
+        self.names = {}  # name -> set of (namespace, name)
+        self.labels = {}  # (label, value) -> set of (namespace, name)
+        self.is_stale = True
+
+    def _key(self, obj):
+        return (obj['metadata'].get('namespace'), obj['metadata']['name'])
+
+    def _put(self, obj):
+        key = self._key(obj)
+        self._remove(key)
+        self.objects[key] = obj
+        self.names.setdefault(key[1], set()).add(key)
+        for label in (obj['metadata'].get('labels') or {}).items():
+            self.labels.setdefault(label, set()).add(key)
+
+    def _remove(self, key):
+        obj = self.objects.pop(key, None)
+        if obj is None:
+            return
+        self.names[key[1]].discard(key)
+        for label in (obj['metadata'].get('labels') or {}).items():
+            self.labels[label].discard(key)
+
+    def _load(self):
+        self.objects = {}
+        self.names = {}
+        self.labels = {}
+        for obj in self.lister():
+            self._put(obj)
+
+    def stale(self):
+        self.is_stale = True
+
+    def _ready(self):
+        if self.is_stale:
+            self._load()
+            self.is_stale = False
+
+    def get(self, name):
+        """An object of that name, or None"""
+        with self.lock:
+            self._ready()
+            for key in self.names.get(name, ()):
+                return self.objects[key]
+            return None
+
+    def select(self, selector=None):
+        """Objects matching the label selector (all of them without selector)"""
+        terms = parse_selector(selector)
+        with self.lock:
+            self._ready()
+            keys = None
+            for (label, operator, values) in terms:
+                if operator == '=':
+                    matching = self.labels.get((label, list(values)[0]), set())
+                    keys = matching if keys is None else keys & matching
+            if keys is None:
+                keys = self.objects.keys()
+            return [self.objects[x] for x in keys if match_selector(self.objects[x]['metadata'].get('labels') or {}, terms)]
+
+    def put(self, obj):
+        """Record an object written by the module"""
+        with self.lock:
+            if self.objects is not None:
+                self._put(obj)
+
+    def remove(self, namespace, name):
+        with self.lock:
+            if self.objects is not None:
+                self._remove((namespace, name))
+
 
 class KubeManager(object):
 
+    # Seconds before a failed discovery refresh is tried again
+    REFRESH_BACKOFF = 30
+
     def __init__(self, module):
 
         self.module = module
@@ -109,14 +594,92 @@ class KubeManager(object):
         if module.params.get('namespace'):
             self.base_cmd.append('--namespace=' + module.params.get('namespace'))
 
+        self.cache_dir = os.path.expanduser(module.params.get('cache_dir'))
+        self.base_cmd.append('--cache-dir=' + self.cache_dir)
+        if module.params.get('cache_ttl') > 0:
+            self._refresh_cache(module.params.get('cache_ttl'))
+
         self.all = module.params.get('all')
         self.force = module.params.get('force')
         self.name = module.params.get('name')
         self.filename = module.params.get('filename')
         self.resource = module.params.get('resource')
         self.label = module.params.get('label')
+        self.field_manager = module.params.get('field_manager')
+        self.workers = module.params.get('workers')
+        self._documents = None
+        self._snapshots = {}
+        self._snapshots_lock = threading.Lock()
+
+    def _refresh_cache(self, ttl):
+        """Refresh the discovery cache of cache_dir at most once per ttl for a cluster, whatever the number
+        of tasks (and forks) sharing it: the first task finding it expired runs kubectl api-resources, which
+        ignores and rewrites the cache, while the others wait for it. All kubectl commands then use that cache.
+        A failed refresh is recorded too, to be tried again after REFRESH_BACKOFF, not once per waiting task."""
+        kubeconfig = os.environ.get('KUBECONFIG') or os.path.expanduser('~/.kube/config')
+        identity = [self.module.params.get('server') or '', kubeconfig]
+        # A change of context or credentials rewrites the kubeconfig
+        for path in kubeconfig.split(os.pathsep):
+            if os.path.exists(path):
+                identity.append(str(os.path.getmtime(path)))
+        marker = os.path.join(self.cache_dir, 'refreshed-' + hashlib.sha1('|'.join(identity).encode('utf-8')).hexdigest())
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(os.path.join(self.cache_dir, '.lock'), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if os.path.exists(marker) and time.time() - os.path.getmtime(marker) < ttl:
+                    return
+                rc, out, err = self.module.run_command(self.base_cmd + ['api-resources', '--output=name'])
+                open(marker, 'w').close()
+                if rc != 0:
+                    # Expires after REFRESH_BACKOFF
+                    expired = time.time() - ttl + min(ttl, self.REFRESH_BACKOFF)
+                    os.utime(marker, (expired, expired))
+        except (IOError, OSError):
+            # Not an error: kubectl discovers by itself
+            pass
+
+    def _snapshot(self, resource, namespace):
+        """Snapshot of resource in namespace ('' for the default one, None for all namespaces)"""
+        with self._snapshots_lock:
+            if (resource, namespace) not in self._snapshots:
+                self._snapshots[(resource, namespace)] = Snapshot(lambda: self._list(resource, namespace))
+            return self._snapshots[(resource, namespace)]
+
+    def _list(self, resource, namespace):
+        args = self.base_cmd + ['get', resource, '--output=json']
+        if namespace is None:
+            args.append('--all-namespaces')
+        elif namespace:
+            args.append('--namespace=' + namespace)
+        rc, out, err = self.module.run_command(args)
+        if rc != 0:
+            raise Exception(err or out)
+        return json.loads(out).get('items') or []
+
+    def _stale(self):
+        with self._snapshots_lock:
+            for snapshot in self._snapshots.values():
+                snapshot.stale()
+
+    def _documents_from_files(self):
+        if self._documents is None:
+            self._documents = load_manifests(self.module, self.filename)
+        return self._documents
+
+    def _live(self, document):
+        """Live version of a document, or None"""
+        (group, _, version) = document['apiVersion'].rpartition('/')
+        resource = document['kind'].lower() + ('.%s.%s' % (version, group) if group else '')
+        namespace = self.module.params.get('namespace') or document['metadata'].get('namespace') or ''
+        try:
+            return self._snapshot(resource, namespace).get(document['metadata']['name'])
+        except Exception:
+            return None
 
     def _execute(self, cmd):
+        self._stale()
         args = self.base_cmd + cmd
         try:
             rc, out, err = self.module.run_command(args)
@@ -128,15 +691,77 @@ class KubeManager(object):
                 msg='error running kubectl (%s) command: %s' % (' '.join(args), str(exc)))
         return out.splitlines()
 
-    def _execute_nofail(self, cmd):
-        args = self.base_cmd + cmd
-        rc, out, err = self.module.run_command(args)
+    def _stdin(self, documents):
+        if len(documents) == 1:
+            return yaml.safe_dump(documents[0], default_flow_style=False)
+        return yaml.safe_dump({'apiVersion': 'v1', 'kind': 'List', 'items': documents}, default_flow_style=False)
+
+    def _execute_documents(self, cmd, documents):
+        self._stale()
+        args = self.base_cmd + cmd + ['--filename=-']
+        rc, out, err = self.module.run_command(args, data=self._stdin(documents))
         if rc != 0:
-            return None
+            names = ', '.join('%s/%s' % (x.get('kind'), x['metadata'].get('name')) for x in documents)
+            raise Exception('%s: %s' % (names, (err or out).strip()))
         return out.splitlines()
 
+    def _execute_manifests(self, cmd, reverse=False, documents=None, output=None):
+        """Run cmd on the objects of the definition file(s), fed on stdin, stamped with their hash.
+        Objects of a single file are given to one kubectl command. Otherwise, they are processed one by one,
+        wave after wave, with up to 'workers' kubectl processes at once.
+        The output lines of each command are turned into result lines by output, when provided."""
+        def execute(cmd, documents):
+            lines = self._execute_documents(cmd, documents)
+            return lines if output is None else output(lines)
+
+        if not HAS_YAML:
+            return self._execute(cmd + ['--filename=' + x for x in self.filename])
+
+        if documents is None:
+            documents = self._documents_from_files()
+
+        if len(self.filename) == 1 and not os.path.isdir(self.filename[0]):
+            try:
+                return execute(cmd, documents)
+            except Exception as exc:
+                self.module.fail_json(msg='error running kubectl (%s) command: %s' % (' '.join(cmd), str(exc)))
+
+        result = []
+        waves = split_waves(documents, reverse)
+        for (i, wave) in enumerate(waves):
+            (outputs, errors) = run_parallel(lambda body: execute(cmd, [body]), wave, self.workers)
+            for lines in outputs:
+                result.extend(lines or [])
+            if errors:
+                fail_objects(self.module, errors, result)
+            if not reverse and i < len(waves) - 1:
+                self._wait_established(wave, result)
+        return result
+
+    def _wait_established(self, documents, result):
+        """Wait for the CustomResourceDefinitions among documents to be established (served by the API)"""
+        names = ['customresourcedefinition/' + x['metadata']['name'] for x in documents
+                 if x.get('kind') == 'CustomResourceDefinition']
+        if not names:
+            return
+        rc, out, err = self.module.run_command(self.base_cmd + ['wait', '--for=condition=established',
+                                                                '--timeout=%ds' % ESTABLISH_TIMEOUT] + names)
+        if rc != 0:
+            fail_objects(self.module, [(err or out).strip()], result)
+
+    def _execute_existing(self, cmd):
+        """Run cmd (delete or stop) on the objects of the definition file(s) which still exist, in reverse wave order"""
+        documents = None
+        if HAS_YAML and not self.force:
+            documents = [x for x in self._documents_from_files() if self._live(x) is not None]
+            if not documents:
+                return []
+        if documents is None:
+            cmd = cmd + ['--ignore-not-found']
+        return self._execute_manifests(cmd, reverse=True, documents=documents)
+
     def create(self, check=True):
-        if check and self.exists():
+        if check and self.resource and self.exists():
             return []
 
         cmd = ['create']
@@ -144,9 +769,14 @@ class KubeManager(object):
         if not self.filename:
             self.module.fail_json(msg='filename required to create')
 
-        cmd.append('--filename=' + self.filename)
+        documents = None
+        if check and not self.resource and HAS_YAML:
+            # Only the missing objects are created
+            documents = [x for x in self._documents_from_files() if self._live(x) is None]
+            if not documents:
+                return []
 
-        return self._execute(cmd)
+        return self._execute_manifests(cmd, documents=documents)
 
     def replace(self):
 
@@ -161,19 +791,25 @@ class KubeManager(object):
         if not self.filename:
             self.module.fail_json(msg='filename required to reload')
 
-        cmd.append('--filename=' + self.filename)
+        documents = None
+        if HAS_YAML:
+            # Skip the objects whose live version was written from the same definition
+            documents = [x for x in self._documents_from_files()
+                         if manifest_hash(x) != manifest_hash(self._live(x) or {})]
+            if not documents:
+                return []
 
-        return self._execute(cmd)
+        return self._execute_manifests(cmd, documents=documents)
 
     def delete(self):
 
-        if not self.force and not self.exists():
+        if not self.force and not self.filename and not self.exists():
             return []
 
         cmd = ['delete']
 
         if self.filename:
-            cmd.append('--filename=' + self.filename)
+            return self._execute_existing(cmd)
         else:
             if not self.resource:
                 self.module.fail_json(msg='resource required to delete without filename')
@@ -195,38 +831,94 @@ class KubeManager(object):
         return self._execute(cmd)
 
     def exists(self):
-        cmd = ['get']
-
         if not self.resource:
-            return False
+            if not self.filename or not HAS_YAML:
+                return False
+            return all(self._live(x) is not None for x in self._documents_from_files())
 
-        cmd.append(self.resource)
+        namespace = None if self.all else ''
+        try:
+            snapshot = self._snapshot(self.resource, namespace)
+            if self.name:
+                obj = snapshot.get(self.name)
+                return obj is not None and match_selector(obj['metadata'].get('labels') or {}, parse_selector(self.label))
+            return len(snapshot.select(self.label)) > 0
+        except Exception:
+            return False
 
-        if self.name:
-            cmd.append(self.name)
+    def apply(self):
 
-        cmd.append('--no-headers')
+        if not self.filename:
+            self.module.fail_json(msg='filename required to apply')
 
-        if self.label:
-            cmd.append('--selector=' + self.label)
+        cmd = ['apply', '--server-side', '--field-manager=' + self.field_manager]
 
-        if self.all:
-            cmd.append('--all-namespaces')
+        if self.force:
+            cmd.append('--force-conflicts')
+
+        if not HAS_YAML:
+            return self._execute_manifests(cmd)
+
+        # A no-op apply does not write the object, so it keeps its resourceVersion
+        before = {}
+        for document in self._documents_from_files():
+            live = self._live(document)
+            if live is not None:
+                key = (document['kind'], live['metadata'].get('namespace'), live['metadata']['name'])
+                before[key] = live['metadata'].get('resourceVersion')
+
+        def applied(lines):
+            output = json.loads('\n'.join(lines))
+            result = []
+            for obj in output.get('items') or [] if output.get('kind') == 'List' else [output]:
+                metadata = obj['metadata']
+                if before.get((obj['kind'], metadata.get('namespace'), metadata['name'])) != metadata.get('resourceVersion'):
+                    (group, _, version) = obj['apiVersion'].rpartition('/')
+                    result.append('%s/%s serverside-applied' % (obj['kind'].lower() + ('.' + group if group else ''),
+                                                                metadata['name']))
+            return result
+
+        return self._execute_manifests(cmd + ['--output=json'], output=applied)
+
+    def wait(self, result):
+        """Wait for the workloads of the definition file(s) to be rolled out, with kubectl rollout status
+        (kubectl wait for Jobs), running at most 'workers' of them at once."""
+        if not HAS_YAML:
+            self.module.warn('PyYAML not installed. Not waiting for the rollout of workloads')
+            return
+
+        deadline = time.time() + self.module.params.get('wait_timeout')
+
+        def wait(body):
+            (group, _, version) = body['apiVersion'].rpartition('/')
+            name = '%s/%s' % (body['kind'].lower() + ('.' + group if group else ''), body['metadata']['name'])
+            timeout = '--timeout=%ds' % max(1, int(deadline - time.time()))
+            if body['kind'] == 'Job':
+                cmd = ['wait', '--for=condition=complete', name, timeout]
+            else:
+                cmd = ['rollout', 'status', name, timeout]
+            if not self.module.params.get('namespace') and body['metadata'].get('namespace'):
+                cmd.append('--namespace=' + body['metadata']['namespace'])
+            rc, out, err = self.module.run_command(self.base_cmd + cmd)
+            if rc != 0:
+                raise Exception('%s: %s' % (name, (err or out).strip()))
 
-        result = self._execute_nofail(cmd)
-        if not result:
-            return False
-        return True
+        # kubectl rollout status fails for the OnDelete update strategy, which has no rollout
+        workloads = [x for x in self._documents_from_files() if x.get('kind') in WORKLOADS and
+                     ((x.get('spec') or {}).get('updateStrategy') or {}).get('type') != 'OnDelete']
+        (outputs, errors) = run_parallel(wait, workloads, self.workers)
+        if errors:
+            fail_objects(self.module, errors, result)
 
     def stop(self):
 
-        if not self.force and not self.exists():
+        if not self.force and not self.filename and not self.exists():
             return []
 
         cmd = ['stop']
 
         if self.filename:
-            cmd.append('--filename=' + self.filename)
+            return self._execute_existing(cmd)
         else:
             if not self.resource:
                 self.module.fail_json(msg='resource required to stop without filename')
@@ -248,12 +940,409 @@ class KubeManager(object):
         return self._execute(cmd)
 
 
+class KubeApiManager(object):
+    """Same operations as KubeManager, performed through the kubernetes python client.
+    A single ApiClient (and its connection pool) is used for all calls."""
+
+    DELETE_TIMEOUT = 60
+
+    def __init__(self, module):
+
+        self.module = module
+
+        configuration = client.Configuration()
+        try:
+            config.load_kube_config(client_configuration=configuration)
+            context_namespace = config.list_kube_config_contexts()[1].get('context', {}).get('namespace')
+        except Exception:
+            config.load_incluster_config(client_configuration=configuration)
+            context_namespace = None
+
+        if module.params.get('server'):
+            configuration.host = module.params.get('server')
+
+        self.client = DynamicClient(client.ApiClient(configuration))
+
+        self.namespace = module.params.get('namespace') or context_namespace or 'default'
+        self.all = module.params.get('all')
+        self.force = module.params.get('force')
+        self.name = module.params.get('name')
+        self.filename = module.params.get('filename')
+        self.resource = module.params.get('resource')
+        self.label = module.params.get('label')
+        self.field_manager = module.params.get('field_manager')
+        self.workers = module.params.get('workers')
+        self._documents = None
+        self._snapshots = {}
+        self._snapshots_lock = threading.Lock()
+
+    def _fail(self, action, exc):
+        self.module.fail_json(msg='error running %s through kubernetes API: %s' % (action, str(exc)))
+
+    def _resolve(self, resource):
+        """Find the API resource matching a kubectl resource argument: kind, plural, singular or short name,
+        optionally followed by .<group>"""
+        name, _, group = resource.lower().partition('.')
+        matches = []
+        for resources in self.client.resources:
+            for api_resource in resources:
+                if isinstance(api_resource, ResourceList) or '/' in (api_resource.name or ''):
+                    continue   # ResourceList or subresource
+                if group and api_resource.group != group:
+                    continue
+                if name in (api_resource.name, api_resource.singular_name, api_resource.kind.lower()) or \
+                        name in (api_resource.short_names or []):
+                    matches.append(api_resource)
+        if not matches:
+            self.module.fail_json(msg='the server does not have a resource type "%s"' % resource)
+        preferred = [x for x in matches if x.preferred]
+        return (preferred or matches)[0]
+
+    def _documents_from_files(self):
+        if self._documents is None:
+            if not self.filename:
+                self.module.fail_json(msg='filename required')
+            self._documents = load_manifests(self.module, self.filename)
+        return self._documents
+
+    def _object(self, body):
+        """(api_resource, namespace, body) of a document"""
+        api_resource = self.client.resources.get(api_version=body['apiVersion'], kind=body['kind'])
+        namespace = None
+        if api_resource.namespaced:
+            namespace = self.module.params.get('namespace') or body.get('metadata', {}).get('namespace') or self.namespace
+        return (api_resource, namespace, body)
+
+    def _run_waves(self, action, function, reverse=False):
+        """Call function on the objects of the definition file(s), wave after wave, with up to 'workers'
+        requests at once. API resources are looked up between waves, as a wave may define the types of the next one:
+        the CustomResourceDefinitions of a wave must be established before the next one."""
+        result = []
+        waves = split_waves(self._documents_from_files(), reverse)
+        for (i, wave) in enumerate(waves):
+            objects = []
+            for body in wave:
+                try:
+                    objects.append(self._object(body))
+                except Exception as exc:
+                    fail_objects(self.module, ['discovery of %s: %s' % (body.get('kind'), str(exc))], result)
+            (outputs, errors) = run_parallel(lambda x: self._call(action, function, x), objects, self.workers)
+            result.extend(x for x in outputs if x)
+            if errors:
+                fail_objects(self.module, errors, result)
+            if not reverse and i < len(waves) - 1:
+                self._wait_established(objects, result)
+        return result
+
+    def _wait_established(self, objects, result):
+        """Wait for the CustomResourceDefinitions among objects to be established (served by the API)"""
+        deadline = time.time() + ESTABLISH_TIMEOUT
+        for (api_resource, namespace, body) in objects:
+            if body.get('kind') != 'CustomResourceDefinition':
+                continue
+            name = body['metadata']['name']
+            while True:
+                crd = self._get(api_resource, name, None)
+                conditions = ((crd.to_dict() if crd is not None else {}).get('status') or {}).get('conditions') or []
+                if any(x['type'] == 'Established' and x['status'] == 'True' for x in conditions):
+                    break
+                if time.time() > deadline:
+                    fail_objects(self.module, ['%s: timeout' % self._describe(api_resource, name, 'establish')], result)
+                time.sleep(0.5)
+
+    def _call(self, action, function, target):
+        """Run function(api_resource, namespace, body or name). Errors are reported with the object they relate to"""
+        (api_resource, namespace, body) = target
+        try:
+            return function(api_resource, namespace, body)
+        except Exception as exc:
+            name = body['metadata']['name'] if isinstance(body, dict) else body
+            # Dynamic client errors embed the whole response and traceback in str()
+            message = exc.summary() if hasattr(exc, 'summary') else str(exc)
+            raise Exception('%s: %s' % (self._describe(api_resource, name, action), message))
+
+    def _describe(self, api_resource, name, action):
+        kind = api_resource.kind.lower() + ('.' + api_resource.group if api_resource.group else '')
+        return '%s/%s %s' % (kind, name, action)
+
+    def _get(self, api_resource, name, namespace):
+        try:
+            return self.client.get(api_resource, name=name, namespace=namespace)
+        except NotFoundError:
+            return None
+
+    def _snapshot(self, api_resource, namespace):
+        """Snapshot of api_resource in namespace (None for all namespaces, or cluster scoped)"""
+        key = (api_resource.group_version, api_resource.kind, namespace)
+        with self._snapshots_lock:
+            if key not in self._snapshots:
+
+                def lister():
+                    return json.loads(self.client.get(api_resource, namespace=namespace, serialize=False).data)['items']
+
+                self._snapshots[key] = Snapshot(lister)
+            return self._snapshots[key]
+
+    def _live(self, api_resource, namespace, name):
+        """Live object, as a dict, or None"""
+        return self._snapshot(api_resource, namespace).get(name)
+
+    def _written(self, api_resource, namespace, obj):
+        self._snapshot(api_resource, namespace).put(obj)
+
+    def _wait_deleted(self, api_resource, name, namespace):
+        deadline = time.time() + self.DELETE_TIMEOUT
+        while self._get(api_resource, name, namespace) is not None:
+            if time.time() > deadline:
+                raise Exception('timeout waiting for deletion')
+            time.sleep(0.5)
+
+    def _targets(self):
+        """(api_resource, namespace, name) of the objects selected by resource, name, label and all"""
+        api_resource = self._resolve(self.resource)
+        namespace = self.namespace if api_resource.namespaced else None
+        if self.name:
+            return [(api_resource, namespace, self.name)]
+        if not self.label and not self.all:
+            self.module.fail_json(msg='resource(s) were provided, but no name, label selector, or all flag specified')
+        try:
+            items = self._snapshot(api_resource, namespace).select(self.label)
+        except Exception as exc:
+            self._fail('get', exc)
+        return [(api_resource, x['metadata'].get('namespace'), x['metadata']['name']) for x in items]
+
+    def create(self, check=True):
+        if check and self.resource and self.exists():
+            return []
+
+        def create(api_resource, namespace, body):
+            # Without resource, existence is checked per object: only the missing ones are created
+            if check and self._live(api_resource, namespace, body['metadata']['name']) is not None:
+                return None
+            self._written(api_resource, namespace, self.client.create(api_resource, body=body, namespace=namespace).to_dict())
+            return self._describe(api_resource, body['metadata']['name'], 'created')
+
+        return self._run_waves('create', create)
+
+    def replace(self):
+
+        if not self.force and self.resource and not self.exists():
+            return []
+
+        def replace(api_resource, namespace, body):
+            name = body['metadata']['name']
+            live = self._live(api_resource, namespace, name)
+            if live is None and not self.force:
+                return None
+            if live is not None and manifest_hash(live) == manifest_hash(body):
+                # Written from the same definition
+                return None
+            if self.force:
+                # As 'kubectl replace --force': delete, then create
+                if live is not None:
+                    try:
+                        self.client.delete(api_resource, name=name, namespace=namespace)
+                    except NotFoundError:
+                        pass
+                    self._wait_deleted(api_resource, name, namespace)
+                obj = self.client.create(api_resource, body=body, namespace=namespace)
+            else:
+                obj = self.client.replace(api_resource, body=body, namespace=namespace)
+            self._written(api_resource, namespace, obj.to_dict())
+            return self._describe(api_resource, name, 'replaced')
+
+        return self._run_waves('replace', replace)
+
+    def _delete(self, propagation_policy=None):
+
+        def delete(api_resource, namespace, name):
+            if isinstance(name, dict):
+                name = name['metadata']['name']
+            try:
+                self.client.delete(api_resource, name=name, namespace=namespace, propagation_policy=propagation_policy)
+            except NotFoundError:
+                # Objects of the definition file(s) already gone are skipped
+                if not self.force and not self.filename:
+                    raise
+                return None
+            self._snapshot(api_resource, namespace).remove(namespace, name)
+            return self._describe(api_resource, name, 'deleted')
+
+        if self.filename:
+            return self._run_waves('delete', delete, reverse=True)
+
+        if not self.resource:
+            self.module.fail_json(msg='resource required to delete without filename')
+        result = []
+        (outputs, errors) = run_parallel(lambda x: self._call('delete', delete, x), self._targets(), self.workers)
+        result.extend(x for x in outputs if x)
+        if errors:
+            fail_objects(self.module, errors, result)
+        return result
+
+    def delete(self):
+
+        if not self.force and not self.filename and not self.exists():
+            return []
+
+        return self._delete()
+
+    def exists(self):
+        if not self.resource:
+            if not self.filename:
+                return False
+            for body in self._documents_from_files():
+                try:
+                    (api_resource, namespace, body) = self._object(body)
+                except Exception:
+                    # Type defined by another object of the files, not created yet
+                    return False
+                if self._live(api_resource, namespace, body['metadata']['name']) is None:
+                    return False
+            return True
+
+        api_resource = self._resolve(self.resource)
+        namespace = self.namespace if api_resource.namespaced and not self.all else None
+        try:
+            if self.name:
+                return self._live(api_resource, namespace, self.name) is not None
+            return len(self._snapshot(api_resource, namespace).select(self.label)) > 0
+        except Exception as exc:
+            self._fail('get', exc)
+
+    def apply(self):
+
+        def apply(api_resource, namespace, body):
+            live = self._live(api_resource, namespace, body['metadata']['name'])
+            response = self.client.server_side_apply(api_resource, body=body, namespace=namespace,
+                                                     field_manager=self.field_manager,
+                                                     force_conflicts=self.force or None, serialize=False)
+            obj = json.loads(response.data)
+            self._written(api_resource, namespace, obj)
+            # A no-op apply does not write the object, so it keeps its resourceVersion
+            if live is None or live['metadata'].get('resourceVersion') != obj['metadata'].get('resourceVersion'):
+                return self._describe(api_resource, body['metadata']['name'], 'serverside-applied')
+            return None
+
+        return self._run_waves('apply', apply)
+
+    def _watch(self, api_resource, namespace, label_selector, events, stop, deadline):
+        """Feed events with (kind, event type, object) for the objects of api_resource in namespace matching
+        label_selector: a list, then a watch from its resourceVersion, resumed when the server closes it,
+        until stop is set."""
+        resource_version = None
+        while not stop.is_set() and time.time() < deadline:
+            try:
+                if resource_version is None:
+                    result = json.loads(self.client.get(api_resource, namespace=namespace, label_selector=label_selector,
+                                                        serialize=False).data)
+                    resource_version = result['metadata']['resourceVersion']
+                    for obj in result['items']:
+                        events.put((api_resource.kind, 'ADDED', obj))
+                for event in self.client.watch(api_resource, namespace=namespace, label_selector=label_selector,
+                                               resource_version=resource_version,
+                                               timeout=max(1, int(deadline - time.time()))):
+                    if stop.is_set():
+                        return
+                    if event['type'] == 'ERROR':
+                        # 410 Gone: list again
+                        resource_version = None
+                        break
+                    resource_version = event['raw_object']['metadata']['resourceVersion']
+                    if event['type'] != 'BOOKMARK':
+                        events.put((api_resource.kind, event['type'], event['raw_object']))
+            except Exception:
+                resource_version = None
+                time.sleep(1)
+
+    def wait(self, result):
+        """Wait for the workloads of the definition file(s) to be rolled out (Jobs: complete).
+        One watch per kind and namespace follows the workloads, and for each of them, watches scoped by its
+        selector follow its pods and revisions: fail as soon as a pod of the current version is failing
+        (see FAILURE_REASONS)."""
+        deadline = time.time() + self.module.params.get('wait_timeout')
+        pending = set()
+        streams = {}
+        for body in self._documents_from_files():
+            if body.get('kind') not in WORKLOADS:
+                continue
+            (api_resource, namespace, body) = self._object(body)
+            pending.add((body['kind'], namespace, body['metadata']['name']))
+            streams[(api_resource.group_version, api_resource.kind, namespace, None)] = (api_resource, namespace, None)
+            selector = selector_string(workload_selector(body))
+            followed = [('v1', 'Pod')]
+            if body['kind'] in REVISIONS:
+                followed.append(REVISIONS[body['kind']][:2])
+            for (api_version, kind) in followed:
+                streams[(api_version, kind, namespace, selector)] = (
+                    self.client.resources.get(api_version=api_version, kind=kind), namespace, selector)
+        if not pending:
+            return
+
+        events = queue.Queue()
+        stop = threading.Event()
+        for (api_resource, namespace, selector) in streams.values():
+            thread = threading.Thread(target=self._watch, args=(api_resource, namespace, selector, events, stop, deadline))
+            thread.daemon = True
+            thread.start()
+
+        live = {}
+        live_pods = {}
+        live_revisions = {}
+        try:
+            while True:
+                failures = []
+                for key in list(pending):
+                    if key not in live:
+                        continue
+                    failure = workload_failure(key[0], live[key], live_pods.values(), live_revisions.values())
+                    if failure:
+                        failures.append('%s/%s: %s' % (key[0].lower(), key[2], failure))
+                    elif rollout_status(key[0], live[key])[0]:
+                        pending.discard(key)
+                if failures:
+                    fail_objects(self.module, failures, result)
+                if not pending:
+                    return
+                try:
+                    event = events.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    self.module.fail_json(msg='timeout waiting for the rollout of %s' % ', '.join(
+                        sorted('%s/%s' % (x[0].lower(), x[2]) for x in pending)), changed=bool(result), result=result)
+                # Apply all received events before checking again
+                while event is not None:
+                    (kind, event_type, obj) = event
+                    key = (kind, obj['metadata'].get('namespace'), obj['metadata']['name'])
+                    if kind in ('Pod', 'ReplicaSet', 'ControllerRevision'):
+                        objects = live_pods if kind == 'Pod' else live_revisions
+                        if event_type == 'DELETED':
+                            objects.pop(key, None)
+                        else:
+                            objects[key] = obj
+                    elif key in pending:
+                        live[key] = obj
+                    try:
+                        event = events.get_nowait()
+                    except queue.Empty:
+                        event = None
+        finally:
+            stop.set()
+
+    def stop(self):
+
+        if not self.force and not self.filename and not self.exists():
+            return []
+
+        # 'kubectl stop' is gone. Graceful deletion: dependents first
+        return self._delete(propagation_policy='Foreground')
+
+
 def main():
 
     module = AnsibleModule(
         argument_spec=dict(
             name=dict(),
-            filename=dict(),
+            filename=dict(type='list'),
             namespace=dict(),
             resource=dict(),
             label=dict(),
@@ -262,13 +1351,27 @@ def main():
             force=dict(default=False, type='bool'),
             all=dict(default=False, type='bool'),
             log_level=dict(default=0, type='int'),
-            state=dict(default='present', choices=['present', 'absent', 'latest', 'reloaded', 'stopped']),
+            state=dict(default='present', choices=['present', 'absent', 'latest', 'reloaded', 'stopped', 'applied']),
+            backend=dict(default='kubectl', choices=['kubectl', 'api']),
+            field_manager=dict(default='ansible'),
+            workers=dict(default=5, type='int'),
+            cache_dir=dict(default='~/.ansible/cache/kube'),
+            cache_ttl=dict(default=600, type='int'),
+            wait=dict(default=False, type='bool'),
+            wait_timeout=dict(default=300, type='int'),
             )
         )
 
     changed = False
 
-    manager = KubeManager(module)
+    if module.params.get('backend') == 'api' and not (HAS_KUBERNETES and HAS_YAML):
+        module.warn('kubernetes python client (>= 19.0.0) or PyYAML not installed. Falling back to kubectl')
+        module.params['backend'] = 'kubectl'
+
+    if module.params.get('backend') == 'api':
+        manager = KubeApiManager(module)
+    else:
+        manager = KubeManager(module)
     state = module.params.get('state')
 
     if state == 'present':
@@ -283,6 +1386,9 @@ def main():
     elif state == 'stopped':
         result = manager.stop()
 
+    elif state == 'applied':
+        result = manager.apply()
+
     elif state == 'latest':
         if manager.exists():
             manager.force = True
@@ -293,6 +1399,10 @@ def main():
     else:
         module.fail_json(msg='Unrecognized state %s.' % state)
 
+    if module.params.get('wait') and module.params.get('filename') and \
+            state in ('present', 'latest', 'reloaded', 'applied'):
+        manager.wait(result)
+
     if result:
         changed = True
     module.exit_json(changed=changed,
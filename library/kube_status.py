@@ -1,8 +1,11 @@
 #!/usr/bin/python
 
+import time
+
 from ansible.module_utils.basic import AnsibleModule
 
-from kubernetes import client, config
+from kubernetes import client, config, watch
+from kubernetes.client.rest import ApiException
 
 DOCUMENTATION = '''
 ---
@@ -20,12 +23,43 @@ options:
         required: false
     label_selector:
         description:
-            - Labels for the pods
+            - Labels for the pods (for the controllers, with C(check=controllers))
+        required: false
+    check:
+        description:
+            - With C(pods), the status of each matching pod is checked.
+            - With C(controllers), the status of the matching Deployments, StatefulSets, DaemonSets and Jobs is
+              checked instead, with the rules of kubectl rollout status (observed generation, ready, updated and
+              available replicas, or the Complete and Failed conditions of the Jobs). Updated replicas are not
+              required with the OnDelete update strategy.
+              Pods are only listed for the controllers which are not ready, to report their container statuses.
+              Not supported with C(wait_for).
+        required: false
+        choices: ['pods', 'controllers']
+        default: pods
+    page_size:
+        description:
+            - Number of pods requested per list call. Pods are processed one page at a time, and only the
+              state of their containers is kept, so memory does not grow with the whole namespace.
+        required: false
+        default: 500
+    wait_for:
+        description:
+            - Instead of checking the pods once, wait for them. With C(ready), return as soon as there are
+              matching pods, and all of them are ready. Fail as soon as a container is in one of the failing
+              states (CrashLoopBackOff, Error, ImagePullBackOff).
+            - Pods are listed once, then followed through a watch from the resourceVersion of that list.
         required: false
+        choices: ['ready']
+    timeout:
+        description:
+            - Number of seconds to wait, with C(wait_for).
+        required: false
+        default: 300
 
 requirements:
   - "python >= 2.7"
-  - "kubernetes >= 4.0.0a1"
+  - "kubernetes >= 12.0.0"
 
 author:
     - Vanessa Vuibert (@vvuibert)
@@ -37,6 +71,21 @@ EXAMPLES = '''
   kube_status:
     namespace: "default"
     label_selector: "app=orchestrator"
+
+# Wait for the orchestrator pods to be ready, instead of retrying
+- name: Wait for orchestrator
+  kube_status:
+    namespace: "default"
+    label_selector: "app=orchestrator"
+    wait_for: ready
+    timeout: 600
+
+# Check the orchestrator controllers, without listing their pods when they are ready
+- name: Check orchestrator controllers
+  kube_status:
+    namespace: "default"
+    label_selector: "app=orchestrator"
+    check: controllers
 '''
 
 RETURN = '''
@@ -46,15 +95,224 @@ container_statuses:
 ready:
     description: Pods are ready
     type: boolean
+controllers:
+    description: Dictionary of the status of the controllers, by kind/name, with C(check=controllers)
+    type: dict
 '''
 
 BAD_REASONS = ['CrashLoopBackOff', 'Error', 'ImagePullBackOff']
 
 
+def pod_summary(pod):
+    """State of the containers of a pod, the failing ones, and whether all of them are ready"""
+    container_statuses = dict()
+    container_failed_statuses = dict()
+    ready = True
+    if pod.status.container_statuses:
+        for status in pod.status.container_statuses:
+            if status.state.running:
+                container_state = {'running': status.state.running.to_dict()}
+            elif status.state.waiting:
+                container_state = {'waiting': status.state.waiting.to_dict()}
+            else:
+                container_state = {'terminated': status.state.terminated.to_dict()}
+            container_statuses[status.name] = container_state
+
+            if not status.ready:
+                ready = False
+                if (status.state.terminated and (status.state.terminated.reason in BAD_REASONS)) or \
+                        (status.state.waiting and (status.state.waiting.reason in BAD_REASONS)):
+                    container_failed_statuses[status.name] = container_state
+    else:
+        ready = False
+        container_failed_statuses = pod.status.to_dict()
+    return container_statuses, container_failed_statuses, ready
+
+
+def selector_string(selector):
+    """Label selector string of a V1LabelSelector"""
+    terms = ['%s=%s' % (key, value) for (key, value) in sorted((selector.match_labels or {}).items())]
+    for expression in selector.match_expressions or []:
+        if expression.operator == 'In':
+            terms.append('%s in (%s)' % (expression.key, ','.join(expression.values)))
+        elif expression.operator == 'NotIn':
+            terms.append('%s notin (%s)' % (expression.key, ','.join(expression.values)))
+        elif expression.operator == 'Exists':
+            terms.append(expression.key)
+        else:
+            terms.append('!' + expression.key)
+    return ','.join(terms)
+
+
+def controller_status(kind, controller):
+    """Whether a controller is ready, from its status only, and a summary of that status,
+    with the rules of kubectl rollout status"""
+    spec = controller.spec
+    status = controller.status
+    conditions = dict((condition.type, condition) for condition in status.conditions or [])
+    if kind == 'job':
+        summary = dict(completions=spec.completions or 1, succeeded=status.succeeded or 0,
+                       active=status.active or 0, failed=status.failed or 0)
+        if 'Failed' in conditions and conditions['Failed'].status == 'True':
+            summary['message'] = conditions['Failed'].message or 'job failed'
+            return False, summary
+        return 'Complete' in conditions and conditions['Complete'].status == 'True', summary
+
+    summary = dict(generation=controller.metadata.generation or 0, observed_generation=status.observed_generation or 0)
+    # Pods are only replaced when deleted: updated replicas are not awaited
+    on_delete = kind in ('daemonset', 'statefulset') and spec.update_strategy and spec.update_strategy.type == 'OnDelete'
+    if kind == 'daemonset':
+        summary.update(replicas=status.desired_number_scheduled or 0, ready_replicas=status.number_ready or 0,
+                       updated_replicas=status.updated_number_scheduled or 0,
+                       available_replicas=status.number_available or 0)
+        ready = (on_delete or summary['updated_replicas'] >= summary['replicas']) and \
+            summary['available_replicas'] >= summary['replicas']
+    elif kind == 'statefulset':
+        # Available replicas are only reported by recent versions
+        summary.update(replicas=1 if spec.replicas is None else spec.replicas,
+                       ready_replicas=status.ready_replicas or 0, updated_replicas=status.updated_replicas or 0)
+        partition = 0
+        if spec.update_strategy and spec.update_strategy.rolling_update:
+            partition = spec.update_strategy.rolling_update.partition or 0
+        ready = summary['ready_replicas'] >= summary['replicas'] and \
+            (on_delete or summary['updated_replicas'] >= summary['replicas'] - partition)
+    else:
+        # Replicas of the previous versions are counted in current_replicas until they are removed
+        summary.update(replicas=1 if spec.replicas is None else spec.replicas, current_replicas=status.replicas or 0,
+                       ready_replicas=status.ready_replicas or 0, updated_replicas=status.updated_replicas or 0,
+                       available_replicas=status.available_replicas or 0)
+        if 'Progressing' in conditions and conditions['Progressing'].reason == 'ProgressDeadlineExceeded':
+            summary['message'] = conditions['Progressing'].message or 'progress deadline exceeded'
+            return False, summary
+        ready = summary['updated_replicas'] >= summary['replicas'] and \
+            summary['current_replicas'] <= summary['updated_replicas'] and \
+            summary['available_replicas'] >= summary['updated_replicas']
+    return summary['observed_generation'] >= summary['generation'] and ready, summary
+
+
+def pages(list_function, namespace, label_selector, page_size):
+    """Objects of the namespace, as successive lists of at most page_size objects (limit/continue).
+    All pages are from the same snapshot, whose resourceVersion is on each of them."""
+    _continue = None
+    while True:
+        object_list = list_function(namespace=namespace, label_selector=label_selector,
+                                    limit=page_size, _continue=_continue)
+        yield object_list
+        _continue = object_list.metadata._continue
+        if not _continue:
+            return
+
+
+def pod_pages(core, namespace, label_selector, page_size):
+    """Pods of the namespace, as pages()"""
+    return pages(core.list_namespaced_pod, namespace, label_selector, page_size)
+
+
+def check_pods(core, namespace, label_selector, page_size, result, pods_fail_statuses):
+    """Add the container states of the pods to the result, and the failing ones to pods_fail_statuses"""
+    for pod_list in pod_pages(core, namespace, label_selector, page_size):
+        for pod in pod_list.items:
+            container_statuses, container_failed_statuses, ready = pod_summary(pod)
+            if not ready and pod.status.container_statuses:
+                result['ready'] = False
+
+            result['container_statuses'][pod.metadata.name] = container_statuses
+            if container_failed_statuses:
+                pods_fail_statuses[pod.metadata.name] = container_failed_statuses
+
+
+def check_controllers(ansible_module, result, pods_fail_statuses):
+    """Check the status of the controllers, and the pods of those which are not ready"""
+    namespace = ansible_module.params['namespace']
+    page_size = ansible_module.params['page_size']
+    apps = client.AppsV1Api()
+    list_functions = [
+        ('deployment', apps.list_namespaced_deployment),
+        ('statefulset', apps.list_namespaced_stateful_set),
+        ('daemonset', apps.list_namespaced_daemon_set),
+        ('job', client.BatchV1Api().list_namespaced_job),
+    ]
+    result['controllers'] = dict()
+    not_ready = []
+    for (kind, list_function) in list_functions:
+        for controller_list in pages(list_function, namespace, ansible_module.params['label_selector'], page_size):
+            for controller in controller_list.items:
+                ready, summary = controller_status(kind, controller)
+                summary['ready'] = ready
+                result['controllers']['%s/%s' % (kind, controller.metadata.name)] = summary
+                if not ready:
+                    result['ready'] = False
+                    not_ready.append(selector_string(controller.spec.selector))
+
+    core = client.CoreV1Api()
+    for label_selector in not_ready:
+        check_pods(core, namespace, label_selector, page_size, result, pods_fail_statuses)
+
+
+def wait_ready(ansible_module, core, result):
+    """List the pods once, then follow them with a watch from the resourceVersion of the list,
+    until all of them are ready, or one of them is failing"""
+    namespace = ansible_module.params['namespace']
+    label_selector = ansible_module.params['label_selector']
+    deadline = time.time() + ansible_module.params['timeout']
+    pods = dict()
+    resource_version = None
+
+    def done():
+        pods_fail_statuses = dict((name, failed) for (name, (statuses, failed, ready)) in pods.items()
+                                  if failed and statuses)
+        if pods_fail_statuses:
+            ansible_module.fail_json(msg="At least one pod is failing",
+                                     container_statuses=pods_fail_statuses,
+                                     ready=False, changed=True)
+        if pods and all(ready for (statuses, failed, ready) in pods.values()):
+            result['container_statuses'] = dict((name, statuses) for (name, (statuses, failed, ready)) in pods.items())
+            return True
+        return False
+
+    while True:
+        if resource_version is None:
+            pods = dict()
+            for pod_list in pod_pages(core, namespace, label_selector, ansible_module.params['page_size']):
+                for pod in pod_list.items:
+                    pods[pod.metadata.name] = pod_summary(pod)
+                resource_version = pod_list.metadata.resource_version
+        if done():
+            return
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            ansible_module.fail_json(msg="Timeout waiting for the pods to be ready",
+                                     container_statuses=dict((name, x[0]) for (name, x) in pods.items()),
+                                     ready=False, changed=True)
+        pod_watch = watch.Watch()
+        try:
+            for event in pod_watch.stream(core.list_namespaced_pod, namespace=namespace,
+                                          label_selector=label_selector, resource_version=resource_version,
+                                          timeout_seconds=max(1, int(remaining))):
+                pod = event['object']
+                resource_version = pod.metadata.resource_version
+                if event['type'] == 'DELETED':
+                    pods.pop(pod.metadata.name, None)
+                else:
+                    pods[pod.metadata.name] = pod_summary(pod)
+                if done():
+                    pod_watch.stop()
+                    return
+        except ApiException as e:
+            if e.status != 410:
+                raise
+            # resourceVersion too old: list again
+            resource_version = None
+
+
 def run_module():
     module_args = dict(
         namespace=dict(type='str', required=False, default='default'),
         label_selector=dict(type='str', required=False, default=''),
+        wait_for=dict(type='str', required=False, choices=['ready']),
+        timeout=dict(type='int', required=False, default=300),
+        page_size=dict(type='int', required=False, default=500),
+        check=dict(type='str', required=False, default='pods', choices=['pods', 'controllers']),
     )
 
     result = dict(
@@ -73,37 +331,30 @@ def run_module():
     if ansible_module.check_mode:
         return result
 
+    if ansible_module.params['check'] == 'controllers' and ansible_module.params['wait_for']:
+        ansible_module.fail_json(msg="wait_for is not supported with check=controllers")
+
     try:
         config.load_kube_config()
-        for pod in client.CoreV1Api().list_namespaced_pod(
-                namespace=ansible_module.params['namespace'],
-                label_selector=ansible_module.params['label_selector']).items:
-            container_statuses = dict()
-            container_failed_statuses = dict()
-            if pod.status.container_statuses:
-                for status in pod.status.container_statuses:
-                    if status.state.running:
-                        container_state = {'running': status.state.running.to_dict()}
-                    elif status.state.waiting:
-                        container_state = {'waiting': status.state.waiting.to_dict()}
-                    else:
-                        container_state = {'terminated': status.state.terminated.to_dict()}
-                    container_statuses[status.name] = container_state
-
-                    if not status.ready:
-                        result['ready'] = False
-                        if (status.state.terminated and (status.state.terminated.reason in BAD_REASONS)) or \
-                                (status.state.waiting and (status.state.waiting.reason in BAD_REASONS)):
-                            container_failed_statuses[status.name] = container_state
-            else:
-                container_failed_statuses = pod.status.to_dict()
+        if ansible_module.params['wait_for'] == 'ready':
+            wait_ready(ansible_module, client.CoreV1Api(), result)
+            result['changed'] = True
+            ansible_module.exit_json(**result)
 
-            result['container_statuses'][pod.metadata.name] = container_statuses
-            if container_failed_statuses:
-                pods_fail_statuses[pod.metadata.name] = container_failed_statuses
+        if ansible_module.params['check'] == 'controllers':
+            check_controllers(ansible_module, result, pods_fail_statuses)
+        else:
+            check_pods(client.CoreV1Api(), ansible_module.params['namespace'],
+                       ansible_module.params['label_selector'], ansible_module.params['page_size'],
+                       result, pods_fail_statuses)
 
         result['changed'] = True
         if pods_fail_statuses:
+            if 'controllers' in result:
+                ansible_module.fail_json(msg="At least one pod is failing",
+                                         container_statuses=pods_fail_statuses,
+                                         controllers=result['controllers'],
+                                         ready=False, changed=True)
             ansible_module.fail_json(msg="At least one pod is failing",
                                      container_statuses=pods_fail_statuses,
                                      ready=False, changed=True)